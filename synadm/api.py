@@ -30,10 +30,325 @@ https://matrix.org/docs/spec/#matrix-apis.
 
 import requests
 from http.client import HTTPConnection
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, wait
+import base64
 import datetime
+import hashlib
 import json
+import os
 import urllib.parse
 import re
+import random
+import threading
+import time
+
+
+def hash_media(args):
+    """Download media and calculate the SHA-256 hash of its content
+
+    This is a module-level function, so it can be run in worker processes.
+
+    Args:
+        args (tuple): (urls, headers, timeout, chunk_size); urls is a list of
+            URLs tried one after the other until the media is found,
+            headers and timeout are passed to requests and chunk_size is the
+            number of bytes downloaded and hashed at once.
+
+    Returns:
+        string or None: the hex digest of the media's hash or None if it
+            could not be downloaded.
+    """
+    urls, headers, timeout, chunk_size = args
+    for url in urls:
+        try:
+            with requests.get(url, headers=headers, timeout=timeout,
+                              stream=True) as resp:
+                if not resp.ok:
+                    continue
+                sha256 = hashlib.sha256()
+                for chunk in resp.iter_content(chunk_size=chunk_size):
+                    sha256.update(chunk)
+                return sha256.hexdigest()
+        except Exception:
+            continue
+    return None
+
+
+class RateLimiter:
+    """Limit the rate of calls, shared by several threads
+    """
+    def __init__(self, rate):
+        """Initialize a RateLimiter object
+
+        Args:
+            rate (float): maximum number of calls per second. None or 0
+                disables rate limiting.
+        """
+        self.interval = 1 / rate if rate else 0
+        self.next_call = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next call is allowed
+        """
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(self.next_call, now) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RecordingTransport:
+    """Send requests and append them and their responses to a cassette file
+
+    The cassette is a JSON lines file, one request/response pair per line.
+    The Authorization header is never written, and passwords and access
+    tokens in request and response bodies are redacted.
+    """
+    REDACTED_KEYS = ("access_token", "refresh_token", "password",
+                     "new_password")
+
+    def __init__(self, path):
+        """Initialize a RecordingTransport object
+
+        Args:
+            path (string): The cassette file; it's created or appended to.
+        """
+        self.handle = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    @classmethod
+    def redact(cls, data):
+        """Replace the values of sensitive keys in nested dicts and lists
+        """
+        if isinstance(data, dict):
+            return {
+                key: "REDACTED" if key in cls.REDACTED_KEYS
+                else cls.redact(value)
+                for key, value in data.items()
+            }
+        if isinstance(data, list):
+            return [cls.redact(value) for value in data]
+        return data
+
+    @staticmethod
+    def request_key(method, url, params=None, json=None):
+        """Return what identifies a request in a cassette
+
+        The host is left out, so a cassette can be replayed against a
+        different base URL.
+        """
+        params = {
+            key: str(value) for key, value in (params or {}).items()
+            if value is not None
+        }
+        return {
+            "method": method.upper(),
+            "path": urllib.parse.urlparse(url).path,
+            "params": params,
+            "json": RecordingTransport.redact(json)
+        }
+
+    def request(self, method, url, **kwargs):
+        """Send a request like requests.request and record it
+
+        Streamed responses are read completely before being returned.
+        """
+        kwargs.pop("stream", None)
+        start = time.perf_counter()
+        resp = requests.request(method, url, **kwargs)
+        elapsed = time.perf_counter() - start
+        entry = self.request_key(method, url, kwargs.get("params"),
+                                 kwargs.get("json"))
+        entry.update({
+            "status": resp.status_code,
+            "content_type": resp.headers.get("Content-Type", ""),
+            "elapsed": round(elapsed, 6)
+        })
+        try:
+            entry["response"] = self.redact(resp.json())
+        except ValueError:
+            entry["content"] = base64.b64encode(resp.content).decode()
+        line = json.dumps(entry)
+        with self.lock:
+            self.handle.write(line + "\n")
+            self.handle.flush()
+        return resp
+
+
+class ReplayTransport:
+    """Answer requests with the responses recorded in a cassette file
+
+    Requests are matched by method, path, URL parameters and body. Requests
+    carrying timestamps, like the expiry of a user login or the cut-off of
+    a media purge, can't match exactly when replayed later; those are
+    matched with the timestamps left out, and a warning is logged.
+    If a request was recorded several times, the responses are returned in
+    the recorded order and the last one is repeated once all were used.
+    """
+    TIMESTAMP_KEY = re.compile(r"(_ts|_ms|_time)$")
+
+    def __init__(self, path, latency=False, log=None):
+        """Initialize a ReplayTransport object
+
+        Args:
+            path (string): A cassette file written by RecordingTransport.
+            latency (bool): Wait for the recorded duration of each request
+                before returning its response, otherwise replay at full
+                speed.
+            log (logger object): Used to warn about inexact matches.
+        """
+        self.latency = latency
+        self.log = log
+        self.responses = {}
+        self.lock = threading.Lock()
+        with open(path, encoding="utf-8") as handle:
+            for line in handle:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                for key in self._keys(entry):
+                    self.responses.setdefault(key, []).append(entry)
+
+    @classmethod
+    def _keys(cls, entry):
+        """Return the exact key of a request and, if it carries timestamps,
+        the key with the timestamps left out
+        """
+        def without_timestamps(data):
+            if not isinstance(data, dict):
+                return data
+            return {key: value for key, value in data.items()
+                    if not cls.TIMESTAMP_KEY.search(key)}
+
+        keys = [json.dumps([entry["method"], entry["path"], entry["params"],
+                            entry["json"]], sort_keys=True)]
+        params = without_timestamps(entry["params"])
+        body = without_timestamps(entry["json"])
+        if params != entry["params"] or body != entry["json"]:
+            keys.append(json.dumps(
+                [entry["method"], entry["path"], params, body, "inexact"],
+                sort_keys=True
+            ))
+        return keys
+
+    def request(self, method, url, **kwargs):
+        """Return the recorded response to a request like requests.request
+
+        Raises:
+            requests.exceptions.ConnectionError: if the request was not
+                recorded.
+        """
+        request = RecordingTransport.request_key(
+            method, url, kwargs.get("params"), kwargs.get("json")
+        )
+        keys = self._keys(request)
+        with self.lock:
+            key = next((key for key in keys if key in self.responses), None)
+            if key is None:
+                raise requests.exceptions.ConnectionError(
+                    f"No recorded response for {method.upper()} {url}"
+                )
+            entries = self.responses[key]
+            entry = entries.pop(0) if len(entries) > 1 else entries[0]
+        if entry["params"].get("from") != request["params"].get("from"):
+            # Never answer with a different page of a paginated list.
+            raise requests.exceptions.ConnectionError(
+                f"No recorded response for {method.upper()} {url}"
+            )
+        if key != keys[0] and self.log:
+            self.log.warning(
+                "Replaying a response recorded with different timestamps "
+                "for %s %s", method.upper(), url
+            )
+        if self.latency:
+            time.sleep(entry["elapsed"])
+        resp = requests.Response()
+        resp.status_code = entry["status"]
+        resp.url = url
+        resp.headers["Content-Type"] = entry["content_type"]
+        if "response" in entry:
+            resp._content = json.dumps(entry["response"]).encode()
+        else:
+            resp._content = base64.b64decode(entry["content"])
+        resp.headers["Content-Length"] = str(len(resp._content))
+        resp._content_consumed = True
+        resp.elapsed = datetime.timedelta(
+            seconds=entry["elapsed"] if self.latency else 0
+        )
+        return resp
+
+
+class RequestStats:
+    """Collect the duration and size of requests per endpoint
+
+    Shared by several ApiRequest objects and threads. IDs in paths are
+    replaced by placeholders, so e.g. all user details requests are
+    counted as GET _synapse/admin/v2/users/{user_id}.
+    """
+    ENDPOINT_PATTERNS = [
+        (r"/(@|%40)[^/]+", "/{user_id}"),
+        (r"/(!|%21)[^/]+", "/{room_id}"),
+        (r"/(#|%23)[^/]+", "/{room_alias}"),
+        (r"/(\$|%24)[^/]+", "/{event_id}"),
+        (r"/download/[^/]+/[^/]+$", "/download/{server_name}/{media_id}"),
+        (r"/v1/media/protect/[^/]+$", "/v1/media/protect/{media_id}"),
+        (r"/v1/media/quarantine/[^/]+/[^/]+$",
+         "/v1/media/quarantine/{server_name}/{media_id}"),
+        (r"/v1/media/[^/]+/delete$", "/v1/media/{server_name}/delete"),
+        (r"/v1/media/(?!quarantine/|protect/|{)[^/]+/[^/]+$",
+         "/v1/media/{server_name}/{media_id}"),
+        (r"/destinations/[^/]+", "/destinations/{destination}"),
+        (r"/registration_tokens/(?!new$)[^/]+$",
+         "/registration_tokens/{token}"),
+        (r"/purge_history_status/[^/]+$", "/purge_history_status/{purge_id}"),
+        (r"/\d+(?=/|$)", "/{id}"),
+    ]
+
+    def __init__(self):
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def endpoint(cls, method, path):
+        """Return the name requests to path are counted as
+        """
+        path = path.split("?", 1)[0].strip("/")
+        for pattern, replacement in cls.ENDPOINT_PATTERNS:
+            path = re.sub(pattern, replacement, path)
+        return f"{method.upper()} {path}"
+
+    def record(self, method, path, status, duration, ttfb=None, sent=0,
+               received=0):
+        """Add a request to the statistics
+
+        Args:
+            method (string): The HTTP method.
+            path (string): The requested path, without host.
+            status (int): The response's status code, None if the request
+                failed without response.
+            duration (float): Seconds until the response was received
+                completely.
+            ttfb (float): Seconds until the response headers were received.
+            sent (int): Bytes of the request body.
+            received (int): Bytes of the response body.
+        """
+        name = self.endpoint(method, path)
+        with self.lock:
+            stats = self.endpoints.setdefault(name, {
+                "statuses": {}, "durations": [], "ttfbs": [],
+                "sent": 0, "received": 0
+            })
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+            stats["durations"].append(duration)
+            if ttfb is not None:
+                stats["ttfbs"].append(ttfb)
+            stats["sent"] += sent
+            stats["received"] += received
 
 
 class ApiRequest:
@@ -66,6 +381,8 @@ class ApiRequest:
             "Authorization": "Bearer " + self.token
         }
         self.timeout = timeout
+        self.transport = requests
+        self.stats = None
         if debug:
             HTTPConnection.debuglevel = 1
 
@@ -108,20 +425,199 @@ class ApiRequest:
             self.log.debug("Token override! Adjusting headers.")
             self.headers["Authorization"] = "Bearer " + token
 
+        start = time.perf_counter()
         try:
-            resp = getattr(requests, method)(
-                url, headers=self.headers, timeout=self.timeout,
+            resp = self.transport.request(
+                method, url, headers=self.headers, timeout=self.timeout,
                 params=params, json=data, verify=verify
             )
+            self._record(method, url, start, resp, len(resp.content))
             if not resp.ok:
                 self.log.warning(f"{host_descr} returned status code "
                                  f"{resp.status_code}")
             return resp.json()
         except Exception as error:
+            self._record(method, url, start)
             self.log.error("%s while querying %s: %s",
                            type(error).__name__, host_descr, error)
         return None
 
+    def _record(self, method, url, start, resp=None, received=0):
+        """Add a finished request to the statistics, if they are enabled
+
+        Args:
+            method (string): The HTTP method.
+            url (string): The requested URL.
+            start (float): time.perf_counter() when the request was sent.
+            resp (requests.Response): The response, None if the request
+                failed.
+            received (int): Number of bytes of the response body.
+        """
+        if self.stats is None:
+            return
+        duration = time.perf_counter() - start
+        if resp is None:
+            self.stats.record(method, urllib.parse.urlparse(url).path, None,
+                              duration)
+            return
+        body = resp.request.body if resp.request is not None else None
+        self.stats.record(
+            method, urllib.parse.urlparse(url).path, resp.status_code,
+            duration, resp.elapsed.total_seconds(),
+            len(body) if body else 0, received
+        )
+
+    def download(self, urlpart, file_path, chunk_size, size=None):
+        """Download a file, streaming it to disk in chunks
+
+        The response body is never held in memory completely. It's written
+        to a temporary file first, which is renamed once the download is
+        complete. An existing file is not downloaded again if its size
+        matches the expected size or the Content-Length of the response.
+
+        Args:
+            urlpart (string): The path to the API endpoint, see query.
+            file_path (string): Where to save the file.
+            chunk_size (int): Number of bytes read and written at once.
+            size (int, optional): The expected size of the file in bytes, if
+                known upfront.
+
+        Returns:
+            dict or None: Either {"status": "skipped"} or {"status":
+                "downloaded", "bytes": <number of bytes>} or the API's
+                response on errors, which is usually a dict containing an
+                errcode. None if an exception occured.
+        """
+        if size is not None and os.path.isfile(file_path):
+            if os.path.getsize(file_path) == size:
+                return {"status": "skipped"}
+        url = f"{self.base_url}/{self.path}/{urlpart}"
+        self.log.info("Downloading %s", url)
+        start = time.perf_counter()
+        try:
+            with self.transport.request(
+                "get", url, headers=self.headers, timeout=self.timeout,
+                stream=True
+            ) as resp:
+                if not resp.ok:
+                    self._record("get", url, start, resp, len(resp.content))
+                    self.log.warning(f"Synapse returned status code "
+                                     f"{resp.status_code}")
+                    return resp.json()
+                length = resp.headers.get("Content-Length")
+                if (
+                    length is not None
+                    and os.path.isfile(file_path)
+                    and os.path.getsize(file_path) == int(length)
+                ):
+                    self._record("get", url, start, resp)
+                    return {"status": "skipped"}
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                written = 0
+                with open(file_path + ".part", "wb") as handle:
+                    for chunk in resp.iter_content(chunk_size=chunk_size):
+                        handle.write(chunk)
+                        written += len(chunk)
+                os.replace(file_path + ".part", file_path)
+                self._record("get", url, start, resp, written)
+                return {"status": "downloaded", "bytes": written}
+        except Exception as error:
+            self._record("get", url, start)
+            self.log.error("%s while downloading %s: %s",
+                           type(error).__name__, url, error)
+        return None
+
+    def _paginate(self, urlpart, key, params=None, limit=100):
+        """Iterate over all items of a paginated API endpoint
+
+        Pages are fetched lazily, one after the other, so only a single page
+        is held in memory at a time. Both pagination styles of the Synapse
+        admin API (next_token and next_batch) are supported.
+
+        Args:
+            urlpart (string): The path to the API endpoint, see query.
+            key (string): The key of the list of items in each response, e.g
+                "users".
+            params (dict, optional): Additional URL parameters.
+            limit (int): Maximum number of items fetched per page.
+
+        Yields:
+            dict: The items of all pages. If a page could not be fetched, an
+                error is logged and None is yielded as the last item.
+        """
+        params = dict(params or {}, limit=limit)
+        while True:
+            page = self.query("get", urlpart, params=params)
+            if page is None or key not in page:
+                self.log.error("Fetching %s failed: %s", urlpart, page)
+                yield None
+                return
+            yield from page[key]
+            next_from = page.get("next_token", page.get("next_batch"))
+            if next_from is None:
+                return
+            params["from"] = next_from
+
+    def _concurrently(self, func, items, workers, rate=None,
+                      processes=False):
+        """Call a function for each item using a pool of threads
+
+        Only a bounded number of items is submitted to the pool at any time,
+        thus items can be a generator (e.g the one returned by _paginate)
+        that is consumed while results are still coming in.
+
+        Args:
+            func (callable): Called with a single item as argument.
+            items (iterable): Arguments for func.
+            workers (int): Maximum number of concurrent calls.
+            rate (float, optional): Maximum number of calls started per
+                second.
+            processes (bool): Use a pool of processes instead of threads,
+                for CPU-bound work. func and items need to be picklable then
+                and rate is not supported.
+
+        Yields:
+            tuple: (item, result) in the order the calls complete.
+        """
+        if rate:
+            limiter = RateLimiter(rate)
+            unlimited_func = func
+
+            def func(item):
+                limiter.wait()
+                return unlimited_func(item)
+
+        executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        with executor(max_workers=workers) as pool:
+            pending = {}
+            for item in items:
+                if len(pending) >= workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield pending.pop(future), future.result()
+                pending[pool.submit(func, item)] = item
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+
+    def _parse_mxc(self, mxc_uri):
+        """Split an mxc URI into server name and media ID
+
+        Args:
+            mxc_uri (string): e.g mxc://example.org/abcdefg
+
+        Returns:
+            tuple or None: (server_name, media_id) or None if mxc_uri is not
+                a valid mxc URI. Server names consisting of dots only, like
+                "..", are rejected since they'd escape directories media is
+                saved to.
+        """
+        match = re.match(r"^mxc://([-\[\].:\w]+)/([-\w]+)$", mxc_uri.strip())
+        if not match or not match.group(1).strip("."):
+            return None
+        return match.group(1), match.group(2)
+
     def _timestamp_from_days_ago(self, days):
         """Get a unix timestamp in ms from days ago
 
@@ -176,6 +672,54 @@ class ApiRequest:
         else:
             return dt_o
 
+    def _timestamp_from_options(self, before_days, before, _before_ts):
+        """ Get a unix timestamp in ms from one of the typical CLI options
+
+        Args:
+            before_days (int): number of days ago
+            before (datetime object): an object built by datetime.datetime
+            _before_ts (int): a unix timestamp in ms, passed through as is
+
+        Returns:
+            int or None: a unix timestamp in milliseconds (ms) or None if
+                none of the arguments was set.
+        """
+        if before_days:
+            self.log.debug("Received --before-days: %s", before_days)
+            return self._timestamp_from_days_ago(before_days)
+        if before:
+            self.log.debug("Received --before: %s", before)
+            return self._timestamp_from_datetime(before)
+        if _before_ts is not None:
+            self.log.debug("Received --before-ts: %s", _before_ts)
+            return _before_ts  # Click checks for int already
+        return None
+
+    def _time_slices(self, start_ts, end_ts, slice_days):
+        """ Split a period of time into slices of a given number of days
+
+        Args:
+            start_ts (int): unix timestamp in ms the first slice starts at
+            end_ts (int): unix timestamp in ms the last slice ends at
+            slice_days (int): length of a slice in days; the last slice might
+                be shorter.
+
+        Yields:
+            tuple: (from_ts, before_ts) unix timestamps in ms of each slice
+
+        Raises:
+            ValueError: If slice_days is not positive, which would never
+                advance past start_ts.
+        """
+        if slice_days <= 0:
+            raise ValueError(f"slice_days must be positive, not {slice_days}")
+        slice_ms = slice_days * 24 * 60 * 60 * 1000
+        from_ts = start_ts
+        while from_ts < end_ts:
+            before_ts = min(from_ts + slice_ms, end_ts)
+            yield from_ts, before_ts
+            from_ts = before_ts
+
     def _format_datetime(self, datetime_obj):
         """ Get a formatted date as a string.
 
@@ -318,6 +862,34 @@ class Matrix(ApiRequest):
             "get", f"client/r0/rooms/{urllib.parse.quote(room_id)}/aliases"
         )
 
+    def media_download(self, server_name, media_id, file_path, chunk_size,
+                       size=None):
+        """ Download a piece of media, see ApiRequest.download
+
+        The authenticated media endpoint is tried first. If the server doesn't
+        know it yet, the legacy media download endpoint is used.
+
+        Args:
+            server_name (string): The server name part of the mxc URI.
+            media_id (string): The media ID part of the mxc URI.
+            file_path (string): Where to save the file.
+            chunk_size (int): Number of bytes read and written at once.
+            size (int, optional): The expected size of the file in bytes.
+
+        Returns:
+            dict or None: See ApiRequest.download.
+        """
+        downloaded = self.download(
+            f"client/v1/media/download/{server_name}/{media_id}",
+            file_path, chunk_size, size
+        )
+        if downloaded and downloaded.get("errcode") == "M_UNRECOGNIZED":
+            downloaded = self.download(
+                f"media/v3/download/{server_name}/{media_id}",
+                file_path, chunk_size, size
+            )
+        return downloaded
+
     def raw_request(self, endpoint, method, data, token=None):
         data_dict = {}
         if method != "get":
@@ -409,6 +981,108 @@ class SynapseAdmin(ApiRequest):
             "user_id": _user_id
         })
 
+    def _oldest_user_ts(self):
+        """ Get the creation date of the oldest local user
+
+        Returns:
+            int or None: a unix timestamp in milliseconds (ms) or None if the
+                user list could not be fetched.
+        """
+        users = self.query("get", "v2/users", params={
+            "limit": 1,
+            "guests": "true",
+            "deactivated": "true",
+            "order_by": "creation_ts"
+        })
+        if not users or not users.get("users"):
+            return None
+        creation_ts = users["users"][0]["creation_ts"]
+        # Older Synapse versions return seconds instead of milliseconds.
+        if creation_ts < 10 ** 11:
+            creation_ts *= 1000
+        return creation_ts
+
+    def user_list_all(self, guests=True, deactivated=True, order_by=None,
+                      reverse=False, page_size=500):
+        """ Iterate over all users, fetching them page by page
+
+        Args:
+            guests (bool): include guest users
+            deactivated (bool): include deactivated users
+            order_by (string, optional): sort users by this field, e.g
+                creation_ts. Defaults to name.
+            reverse (bool): reverse the sort order
+            page_size (int): number of users fetched per request
+
+        Yields:
+            dict: the users as returned by the user list API. None is
+                yielded as the last item if a page could not be fetched.
+        """
+        return self._paginate("v2/users", "users", params={
+            "guests": str(guests).lower(),
+            "deactivated": "true" if deactivated else None,
+            "order_by": order_by,
+            "dir": "b" if reverse else None
+        }, limit=page_size)
+
+    def user_media_statistics_all(self, from_ts=None, until_ts=None,
+                                  order_by=None, reverse=False,
+                                  page_size=500):
+        """ Iterate over the media statistics of all users with local media
+
+        Args:
+            from_ts (int, optional): only count media created at or after
+                this unix timestamp in ms
+            until_ts (int, optional): only count media created before this
+                unix timestamp in ms
+            order_by (string, optional): sort users by this field, one of
+                user_id, displayname, media_length and media_count
+            reverse (bool): reverse the sort order
+            page_size (int): number of users fetched per request
+
+        Yields:
+            dict: user_id, displayname, media_count and media_length of each
+                user. None is yielded as the last item if a page could not be
+                fetched.
+        """
+        return self._paginate("v1/statistics/users/media", "users", params={
+            "from_ts": from_ts,
+            "until_ts": until_ts,
+            "order_by": order_by,
+            "dir": "b" if reverse else None
+        }, limit=page_size)
+
+    def user_media_all(self, user_id):
+        """ Fetch the complete media list of a user
+
+        Args:
+            user_id (string): fully qualified Matrix user ID
+
+        Returns:
+            list or None: the media as returned by the user media API or None
+                if a page could not be fetched.
+        """
+        media_list = []
+        for media in self._paginate(f"v1/users/{user_id}/media", "media",
+                                    limit=500):
+            if media is None:
+                return None
+            media_list.append(media)
+        return media_list
+
+    def user_media_many(self, user_ids, workers):
+        """ Fetch the complete media lists of several users concurrently
+
+        Args:
+            user_ids (iterable): fully qualified Matrix user IDs
+            workers (int): maximum number of concurrent requests
+
+        Yields:
+            tuple: (user_id, media_list) in the order the lists complete,
+                see user_media_all.
+        """
+        return self._concurrently(self.user_media_all, user_ids, workers)
+
     def user_membership(self, user_id, return_aliases, matrix_api):
         """Get a list of rooms the given user is member of
 
@@ -563,6 +1237,41 @@ class SynapseAdmin(ApiRequest):
         """
         return self.query("get", f"v1/whois/{user_id}")
 
+    def user_last_seen(self, user_id):
+        """ Get the time a user was last seen using any session
+
+        Args:
+            user_id (string): Fully qualified Matrix user ID.
+
+        Returns:
+            int: the latest last_seen timestamp of all connections in
+                milliseconds, 0 if no connections are known or None if whois
+                information could not be fetched.
+        """
+        whois = self.user_whois(user_id)
+        if whois is None or "devices" not in whois:
+            return None
+        return max((
+            connection.get("last_seen") or 0
+            for dev in whois["devices"].values()
+            for session in dev.get("sessions", [])
+            for connection in session.get("connections", [])
+        ), default=0)
+
+    def user_last_seen_many(self, user_ids, workers):
+        """ Get the time several users were last seen concurrently
+
+        Args:
+            user_ids (iterable): fully qualified Matrix user IDs, possibly a
+                generator
+            workers (int): maximum number of concurrent requests
+
+        Yields:
+            tuple: (user_id, last_seen) in the order the requests complete,
+                see user_last_seen.
+        """
+        return self._concurrently(self.user_last_seen, user_ids, workers)
+
     def user_devices(self, user_id):
         """ Return information about all devices for a specific user.
 
@@ -575,6 +1284,20 @@ class SynapseAdmin(ApiRequest):
         """
         return self.query("get", f"v2/users/{user_id}/devices")
 
+    def user_devices_many(self, user_ids, workers):
+        """ Fetch the devices of several users concurrently
+
+        Args:
+            user_ids (iterable): fully qualified Matrix user IDs, possibly a
+                generator
+            workers (int): maximum number of concurrent requests
+
+        Yields:
+            tuple: (user_id, devices) in the order the requests complete,
+                devices being the response of user_devices.
+        """
+        return self._concurrently(self.user_devices, user_ids, workers)
+
     def user_devices_get_todelete(self, devices_data, min_days, min_surviving,
                                   device_id, readable_seen):
         """ Gather a list of devices that possibly could be deleted.
@@ -699,6 +1422,100 @@ class SynapseAdmin(ApiRequest):
         """
         return self.query("get", f"v1/rooms/{room_id}")
 
+    def room_list_all(self, order_by=None, reverse=False, page_size=500):
+        """ Iterate over all rooms, fetching them page by page
+
+        Args:
+            order_by (string, optional): sort rooms by this field, see
+                room_list.
+            reverse (bool): reverse the sort order
+            page_size (int): number of rooms fetched per request
+
+        Yields:
+            dict: the rooms as returned by the room list API. None is
+                yielded as the last item if a page could not be fetched.
+        """
+        return self._paginate("v1/rooms", "rooms", params={
+            "order_by": order_by,
+            "dir": "b" if reverse else None
+        }, limit=page_size)
+
+    def room_top(self, order_by, count):
+        """ Get the rooms with the highest value of a counter
+
+        Synapse sorts rooms by counters in descending order, so only the
+        first rooms of the sorted room list need to be fetched, no matter
+        how many rooms there are.
+
+        Args:
+            order_by (string): joined_members, joined_local_members or
+                state_events
+            count (int): number of rooms to return
+
+        Returns:
+            list: the rooms as returned by the room list API, highest value
+                first; or None if a page could not be fetched.
+        """
+        rooms = []
+        for room in self.room_list_all(order_by=order_by,
+                                       page_size=min(count, 500)):
+            if room is None:
+                return None
+            rooms.append(room)
+            if len(rooms) >= count:
+                break
+        return rooms
+
+    def room_details_many(self, room_ids, workers):
+        """ Get details about several rooms concurrently
+
+        Args:
+            room_ids (iterable): room IDs, possibly a generator
+            workers (int): maximum number of concurrent requests
+
+        Yields:
+            tuple: (room_id, details) in the order the requests complete,
+                details being None if an exception occured.
+        """
+        return self._concurrently(self.room_details, room_ids, workers)
+
+    def room_forward_extremities(self, room_id):
+        """ Get the forward extremities of a room
+
+        Returns:
+            string: JSON string containing the admin API's response or None if
+                an exception occured. See Synapse admin API docs for details.
+        """
+        return self.query("get", f"v1/rooms/{room_id}/forward_extremities")
+
+    def room_forward_extremities_delete(self, room_id):
+        """ Delete the forward extremities of a room, except the latest one
+
+        Returns:
+            string: JSON string containing the admin API's response or None if
+                an exception occured. See Synapse admin API docs for details.
+        """
+        return self.query("delete", f"v1/rooms/{room_id}/forward_extremities")
+
+    def room_forward_extremities_many(self, room_ids, workers, delete=False):
+        """ Get or delete the forward extremities of several rooms
+        concurrently
+
+        Args:
+            room_ids (iterable): room IDs, possibly a generator
+            workers (int): maximum number of concurrent requests
+            delete (bool): delete the extremities instead of getting them
+
+        Yields:
+            tuple: (room_id, response) in the order the requests complete,
+                response being None if an exception occured.
+        """
+        if delete:
+            func = self.room_forward_extremities_delete
+        else:
+            func = self.room_forward_extremities
+        return self._concurrently(func, room_ids, workers)
+
     def room_members(self, room_id):
         """ Get a list of room members
         """
@@ -798,6 +1615,71 @@ class SynapseAdmin(ApiRequest):
         """
         return self.query("get", f"v1/room/{room_id}/media")
 
+    def media_backup(self, room_id, user_id, directory, matrix_api, workers,
+                     chunk_size):
+        """ Download all media of a room or uploaded by a user
+
+        Media is saved to directory/<server_name>/<media_id>. Media that has
+        been downloaded already (same file size) is skipped, thus running a
+        backup again only fetches new media.
+
+        Args:
+            room_id (string): Download the media of this room, or
+            user_id (string): download the media uploaded by this user.
+            directory (string): The directory to save media to.
+            matrix_api (object): An initialized Matrix object needs to be
+                passed since media is downloaded via the Matrix API.
+            workers (int): Maximum number of concurrent downloads.
+            chunk_size (int): Number of bytes read and written at once.
+
+        Yields:
+            tuple: (mxc_uri, result) as returned by Matrix.media_download in
+                the order downloads complete. If the media list could not be
+                fetched, (None, response) is yielded.
+        """
+        def media_items():
+            if room_id:
+                media = self.room_media_list(room_id)
+                if media is None or "local" not in media:
+                    yield None, media
+                    return
+                for mxc_uri in media["local"] + media["remote"]:
+                    yield mxc_uri, None
+            else:
+                server_name = user_id.split(":", 1)[1]
+                for media in self._paginate(f"v1/users/{user_id}/media",
+                                            "media", limit=500):
+                    if media is None:
+                        yield None, None
+                        return
+                    yield (f"mxc://{server_name}/{media['media_id']}",
+                           media["media_length"])
+
+        def download(item):
+            mxc_uri, size = item
+            if mxc_uri is None:
+                return size
+            media = self._parse_mxc(mxc_uri)
+            if media is None:
+                return {"error": "Invalid mxc URI"}
+            server_name, media_id = media
+            file_path = os.path.join(directory, server_name, media_id)
+            root = os.path.realpath(directory)
+            if os.path.commonpath(
+                [root, os.path.realpath(file_path)]
+            ) != root:
+                return {"error": "Invalid mxc URI"}
+            return matrix_api.media_download(
+                server_name, media_id, file_path, chunk_size, size
+            )
+
+        for (mxc_uri, _), result in self._concurrently(
+            download, media_items(), workers
+        ):
+            yield mxc_uri, result
+            if mxc_uri is None:
+                return
+
     def media_quarantine(self, server_name, media_id):
         """ Quarantine a single piece of local or remote media
         """
@@ -892,6 +1774,227 @@ class SynapseAdmin(ApiRequest):
             "post", f"v1/media/{server_name}/delete", data={}, params=params
         )
 
+    def media_delete_by_date_or_size_sliced(self, server_name, before_days,
+                                            before, _before_ts, _size_gt,
+                                            delete_profiles, slice_days,
+                                            start=None, pause_factor=1.0):
+        """ Delete local media by date and/or size in time slices
+
+        The delete media API is called once per time slice, starting with the
+        oldest media. Between slices we sleep for the time the last request
+        took, multiplied by pause_factor, so the storage backend of a busy
+        server gets more time to recover than the one of an idle server.
+
+        Args:
+            server_name, before_days, before, _before_ts, _size_gt,
+                delete_profiles: See media_delete_by_date_or_size.
+            slice_days (int): Size of each time slice in days.
+            start (datetime): The first slice starts at this date/time. If
+                None, the creation date of the oldest local user is used.
+            pause_factor (float): Multiplied with the last request's duration
+                to get the pause between slices. 0 disables pausing.
+
+        Yields:
+            dict: The slice's from_ts and before_ts, the duration of the
+                request in seconds (latency) and the admin API's response or
+                None if the request failed. The generator stops after a failed
+                slice.
+        """
+        before_ts = self._timestamp_from_options(before_days, before,
+                                                 _before_ts)
+        if start:
+            start_ts = self._timestamp_from_datetime(start)
+        else:
+            start_ts = self._oldest_user_ts()
+            if start_ts is None:
+                self.log.error("Start of the first time slice could not be "
+                               "determined.")
+                return
+        for from_ts, slice_ts in self._time_slices(start_ts, before_ts,
+                                                   slice_days):
+            started = time.monotonic()
+            deleted = self.media_delete_by_date_or_size(
+                server_name, None, None, slice_ts, _size_gt, delete_profiles
+            )
+            latency = time.monotonic() - started
+            yield {"from_ts": from_ts, "before_ts": slice_ts,
+                   "latency": latency, "response": deleted}
+            if deleted is None:
+                return
+            if pause_factor and slice_ts < before_ts:
+                self.log.debug("Pausing for %.2fs.", latency * pause_factor)
+                time.sleep(latency * pause_factor)
+
+    def media_delete_plan(self, before_days, before, _before_ts, _size_gt,
+                          delete_profiles, workers):
+        """ Estimate what deleting local media by date and/or size would do
+
+        The media lists of all local users are fetched concurrently and
+        filtered client-side the same way Synapse selects media for deletion:
+        last accessed before before_ts (or created before it and never
+        accessed), larger than size_gt and neither quarantined nor protected.
+        Synapse additionally keeps media used as room or profile avatar
+        (unless delete_profiles is set); of those only the users' own avatars
+        are known here, thus the figures are an upper bound in that case.
+
+        Args:
+            before_days, before, _before_ts, _size_gt, delete_profiles: See
+                media_delete_by_date_or_size.
+            workers (int): Number of users processed concurrently.
+
+        Yields:
+            dict: For each user owning media that would be deleted, the user
+                ID, the number of media and their size in bytes. None is
+                yielded as the last item if fetching a list failed.
+        """
+        before_ts = self._timestamp_from_options(before_days, before,
+                                                 _before_ts)
+        size_gt = _size_gt * 1024 if _size_gt else 0
+
+        for user, media_list in self.local_users_media(workers):
+            if media_list is None:
+                yield None
+                return
+            avatar_url = None if delete_profiles else user.get("avatar_url")
+            count, length = 0, 0
+            for media in media_list:
+                last_used_ts = media["last_access_ts"]
+                if last_used_ts is None:
+                    last_used_ts = media["created_ts"]
+                if (
+                    last_used_ts < before_ts
+                    and (media["media_length"] or 0) > size_gt
+                    and not media["quarantined_by"]
+                    and not media["safe_from_quarantine"]
+                    and not (avatar_url
+                             and avatar_url.endswith(media["media_id"]))
+                ):
+                    count += 1
+                    length += media["media_length"]
+            if count:
+                yield {"user_id": user["name"], "media": count,
+                       "bytes": length}
+
+    def media_hash_scan(self, matrix_api, is_hashed, workers, processes,
+                        chunk_size):
+        """ Calculate SHA-256 hashes of the content of all local media
+
+        Media lists are fetched in threads, while media is downloaded and
+        hashed in separate worker processes. Media content is never written
+        to disk.
+
+        Args:
+            matrix_api (object): An initialized Matrix object needs to be
+                passed since media is downloaded via the Matrix API.
+            is_hashed (callable): Called with media ID and size of each media;
+                if it returns True, the media is not hashed (again).
+            workers (int): Number of users whose media lists are fetched
+                concurrently.
+            processes (int): Number of worker processes hashing media.
+            chunk_size (int): Number of bytes read and hashed at once.
+
+        Yields:
+            tuple: (user_id, media, sha256) for each media that was hashed,
+                media being the media's entry in the user media list and
+                sha256 None if it couldn't be downloaded. (None, None, None)
+                is yielded as the last item if a media list could not be
+                fetched.
+        """
+        failed = []
+
+        def unhashed_media():
+            for user, media_list in self.local_users_media(workers):
+                if media_list is None:
+                    failed.append(user)
+                    return
+                server_name = user["name"].split(":", 1)[1]
+                for media in media_list:
+                    if is_hashed(media["media_id"], media["media_length"]):
+                        continue
+                    urls = [
+                        f"{matrix_api.base_url}/{matrix_api.path}/{path}/"
+                        f"{server_name}/{media['media_id']}"
+                        for path in ("client/v1/media/download",
+                                     "media/v3/download")
+                    ]
+                    yield ((urls, matrix_api.headers, matrix_api.timeout,
+                            chunk_size), (user["name"], media))
+
+        def items():
+            for args, meta in unhashed_media():
+                metadata[args[0][0]] = meta
+                yield args
+
+        metadata = {}
+        for args, sha256 in self._concurrently(
+            hash_media, items(), processes, processes=True
+        ):
+            user_id, media = metadata.pop(args[0][0])
+            yield user_id, media, sha256
+        if failed:
+            yield None, None, None
+
+    def local_users_media(self, workers):
+        """ Fetch the media lists of all local users concurrently
+
+        Args:
+            workers (int): Number of media lists fetched concurrently.
+
+        Yields:
+            tuple: (user, media_list) for each user, user being the user's
+                entry in the user list. If a list could not be fetched,
+                media_list is None and it is the last item yielded.
+        """
+        def fetch_media(user):
+            if user is None:
+                return None
+            return self.user_media_all(user["name"])
+
+        for user, media_list in self._concurrently(
+            fetch_media, self.user_list_all(), workers
+        ):
+            yield user, media_list
+            if media_list is None:
+                return
+
+    def local_users_media_statistics(self, workers, from_ts=None,
+                                     until_ts=None):
+        """ Calculate media statistics of all local users from their media
+        lists
+
+        This is a lot slower than user_media_statistics_all but works with
+        Synapse versions lacking the statistics API.
+
+        Args:
+            workers (int): Number of media lists fetched concurrently.
+            from_ts (int, optional): only count media created at or after
+                this unix timestamp in ms
+            until_ts (int, optional): only count media created before this
+                unix timestamp in ms
+
+        Yields:
+            dict: user_id, displayname, media_count and media_length of each
+                user with media. None is yielded as the last item if a list
+                could not be fetched.
+        """
+        for user, media_list in self.local_users_media(workers):
+            if media_list is None:
+                yield None
+                return
+            media_list = [
+                media for media in media_list
+                if (from_ts is None or media["created_ts"] >= from_ts)
+                and (until_ts is None or media["created_ts"] < until_ts)
+            ]
+            if media_list:
+                yield {
+                    "user_id": user["name"],
+                    "displayname": user.get("displayname"),
+                    "media_count": len(media_list),
+                    "media_length": sum(media["media_length"] or 0
+                                        for media in media_list)
+                }
+
     def media_protect(self, media_id):
         """ Protect a single piece of local or remote media
 
@@ -901,19 +2004,60 @@ class SynapseAdmin(ApiRequest):
             "post", f"v1/media/protect/{media_id}", data={}
         )
 
+    def media_bulk(self, action, mxc_uris, local_server_name, workers,
+                   rate):
+        """ Quarantine, delete or protect a list of media
+
+        Args:
+            action (string): One of "quarantine", "delete" or "protect".
+            mxc_uris (iterable): mxc URIs of the media to process.
+            local_server_name (string): Our own server name. Only local media
+                can be deleted or protected.
+            workers (int): Maximum number of concurrent requests.
+            rate (float): Maximum number of requests per second.
+
+        Yields:
+            tuple: (mxc_uri, response) in the order the requests complete,
+                response being the admin API's response or None if an
+                exception occured. Invalid mxc URIs and remote media that
+                can't be deleted or protected are yielded with an error dict
+                instead.
+        """
+        def process(media):
+            server_name, media_id = media
+            if action == "quarantine":
+                return self.media_quarantine(server_name, media_id)
+            if action == "delete":
+                return self.media_delete(server_name, media_id)
+            return self.media_protect(media_id)
+
+        by_server = {}
+        for mxc_uri in mxc_uris:
+            media = self._parse_mxc(mxc_uri)
+            if media is None:
+                yield mxc_uri, {"error": "Invalid mxc URI"}
+            elif action == "delete" and media[0] != local_server_name:
+                yield mxc_uri, {"error": "Remote media can't be deleted"}
+            elif action == "protect" and media[0] != local_server_name:
+                yield mxc_uri, {"error": "Remote media can't be protected"}
+            else:
+                by_server.setdefault(media[0], []).append(media[1])
+
+        media = (
+            (server_name, media_id)
+            for server_name, media_ids in by_server.items()
+            for media_id in media_ids
+        )
+        for (server_name, media_id), response in self._concurrently(
+            process, media, workers, rate
+        ):
+            yield f"mxc://{server_name}/{media_id}", response
+
     def purge_media_cache(self, before_days, before, _before_ts):
         """ Purge old cached remote media
         """
-        if before_days:
-            self.log.debug("Received --before-days: %s", before_days)
-            before_ts = self._timestamp_from_days_ago(before_days)
-        if before:
-            self.log.debug("Received --before: %s", before)
-            before_ts = self._timestamp_from_datetime(before)
-        if _before_ts:
-            self.log.debug("Received --before-ts: %s",
-                           _before_ts)
-            before_ts = _before_ts  # Click checks for int already
+        before_ts = self._timestamp_from_options(before_days, before,
+                                                 _before_ts)
 
         self.log.info("Purging cached remote media older than timestamp: %d,",
                       before_ts)
@@ -926,6 +2070,55 @@ class SynapseAdmin(ApiRequest):
             }
         )
 
+    def purge_media_cache_sliced(self, before_days, before, _before_ts,
+                                 slice_days, start=None, start_ts=None):
+        """ Purge old cached remote media in time slices
+
+        Instead of purging everything older than before_ts in one go, the
+        purge media cache API is called repeatedly with a before_ts advancing
+        from start_ts in steps of slice_days, which keeps every single request
+        short.
+
+        Args:
+            before_days, before, _before_ts: Purge media last accessed before
+                this point in time, see purge_media_cache.
+            slice_days (int): Size of each time slice in days.
+            start (datetime): The first slice starts at this date/time.
+            start_ts (int): Unix timestamp in ms the first slice starts at,
+                e.g to resume an interrupted run. If neither start nor
+                start_ts is given, the creation date of the oldest local user
+                is used, since no media can have been cached before the
+                homeserver existed.
+
+        Yields:
+            dict: The slice's from_ts and before_ts and the admin API's
+                response, or None if the request failed. The generator stops
+                after a failed slice.
+        """
+        before_ts = self._timestamp_from_options(before_days, before,
+                                                 _before_ts)
+        if start:
+            start_ts = self._timestamp_from_datetime(start)
+        elif start_ts is None:
+            start_ts = self._oldest_user_ts()
+            if start_ts is None:
+                self.log.error("Start of the first time slice could not be "
+                               "determined.")
+                return
+        for from_ts, slice_ts in self._time_slices(start_ts, before_ts,
+                                                   slice_days):
+            self.log.info("Purging cached remote media older than %s.",
+                          self._datetime_from_timestamp(slice_ts))
+            purged = self.query(
+                "post", "v1/purge_media_cache", data={}, params={
+                    "before_ts": str(slice_ts)
+                }
+            )
+            yield {"from_ts": from_ts, "before_ts": slice_ts,
+                   "response": purged}
+            if purged is None:
+                return
+
     def version(self):
         """ Get the server version
         """
@@ -983,6 +2176,56 @@ class SynapseAdmin(ApiRequest):
         """
         return self.query("get", f"v1/purge_history_status/{purge_id}")
 
+    def purge_history_status_wait(self, purge_ids, interval, max_interval,
+                                  timeout):
+        """ Poll the status of several history purges until they are finished
+
+        All purges are polled in rounds. After each round the polling interval
+        is doubled (exponential backoff) up to max_interval, and the actual
+        sleep time is randomized (jitter) so that several synadm processes
+        don't hit the API in lockstep.
+
+        Args:
+            purge_ids (list): Purge IDs as returned by the purge history API.
+            interval (float): Seconds to wait after the first polling round.
+            max_interval (float): Upper limit of seconds to wait between
+                polling rounds.
+            timeout (int): Stop polling after this number of seconds, even if
+                purges are still active. None or 0 means wait forever.
+
+        Yields:
+            tuple: (purge_id, status), where status is the admin API's
+                response, as soon as a purge is not "active" anymore. After a
+                timeout, the last known status of purges still pending is
+                yielded (None if it could never be fetched).
+        """
+        pending = {purge_id: None for purge_id in purge_ids}
+        deadline = time.monotonic() + timeout if timeout else None
+        delay = interval
+        while pending:
+            for purge_id in list(pending):
+                status = self.purge_history_status(purge_id)
+                if status is None:
+                    # Network hiccup, keep the purge and try again next round.
+                    continue
+                pending[purge_id] = status
+                if status.get("status") != "active":
+                    del pending[purge_id]
+                    yield purge_id, status
+            if not pending:
+                break
+            sleep = random.uniform(delay / 2, delay)
+            if deadline and time.monotonic() + sleep > deadline:
+                self.log.warning("Timeout reached, %d purge(s) still pending.",
+                                 len(pending))
+                break
+            self.log.debug("%d purge(s) still active, next poll in %.1fs.",
+                           len(pending), sleep)
+            time.sleep(sleep)
+            delay = min(delay * 2, max_interval)
+        for purge_id, status in pending.items():
+            yield purge_id, status
+
     def regtok_list(self, valid, readable_expiry):
         """ List registration tokens
 
@@ -1209,3 +2452,235 @@ class SynapseAdmin(ApiRequest):
         else:
             data["user_id"] = receivers
             return [self.query("post", "v1/send_server_notice", data=data)]
+
+    def event_report_list(self, _from, limit, reverse, user_id, room_id):
+        """ List reported events, newest first
+
+        Args:
+            _from (int): offset of the list
+            limit (int): maximum number of reports to return
+            reverse (bool): list the oldest reports first
+            user_id (string, optional): only list reports by this user
+            room_id (string, optional): only list reports of this room
+
+        Returns:
+            string: JSON string containing the admin API's response or None if
+                an exception occured. See Synapse admin API docs for details.
+        """
+        return self.query("get", "v1/event_reports", params={
+            "from": _from,
+            "limit": limit,
+            "dir": "f" if reverse else None,
+            "user_id": user_id,
+            "room_id": room_id
+        })
+
+    def event_report_list_all(self, reverse=False, user_id=None,
+                              room_id=None, page_size=500):
+        """ Iterate over all reported events, fetching them page by page
+
+        Args:
+            reverse (bool): list the oldest reports first
+            user_id (string, optional): only list reports by this user
+            room_id (string, optional): only list reports of this room
+            page_size (int): number of reports fetched per request
+
+        Yields:
+            dict: the reports as returned by the event reports API. None is
+                yielded as the last item if a page could not be fetched.
+        """
+        return self._paginate("v1/event_reports", "event_reports", params={
+            "dir": "f" if reverse else None,
+            "user_id": user_id,
+            "room_id": room_id
+        }, limit=page_size)
+
+    def event_report_details(self, report_id):
+        """ Get details of a reported event, including the event itself
+
+        Returns:
+            string: JSON string containing the admin API's response or None if
+                an exception occured. See Synapse admin API docs for details.
+        """
+        return self.query("get", f"v1/event_reports/{report_id}")
+
+    def event_report_details_many(self, report_ids, workers):
+        """ Get details of several reported events concurrently
+
+        Args:
+            report_ids (iterable): report IDs, possibly a generator
+            workers (int): maximum number of concurrent requests
+
+        Yields:
+            tuple: (report_id, details) in the order the requests complete,
+                details being None if an exception occured.
+        """
+        return self._concurrently(self.event_report_details, report_ids,
+                                  workers)
+
+    def federation_destinations(self, _from, limit, destination, order_by,
+                                reverse):
+        """ List the remote servers Synapse has federated with
+
+        Args:
+            _from (int): offset of the list
+            limit (int): maximum number of destinations to return
+            destination (string, optional): only list destinations whose
+                server name contains this string
+            order_by (string, optional): sort destinations by this field,
+                e.g failure_ts. Defaults to destination.
+            reverse (bool): reverse the sort order
+
+        Returns:
+            string: JSON string containing the admin API's response or None if
+                an exception occured. See Synapse admin API docs for details.
+        """
+        return self.query("get", "v1/federation/destinations", params={
+            "from": _from,
+            "limit": limit,
+            "destination": destination,
+            "order_by": order_by,
+            "dir": "b" if reverse else None
+        })
+
+    def federation_destinations_all(self, destination=None, order_by=None,
+                                    reverse=False, page_size=500):
+        """ Iterate over all federation destinations, fetching them page by
+        page
+
+        Args:
+            destination (string, optional): only list destinations whose
+                server name contains this string
+            order_by (string, optional): sort destinations by this field
+            reverse (bool): reverse the sort order
+            page_size (int): number of destinations fetched per request
+
+        Yields:
+            dict: the destinations as returned by the destinations API. None
+                is yielded as the last item if a page could not be fetched.
+        """
+        return self._paginate("v1/federation/destinations", "destinations",
+                              params={
+                                  "destination": destination,
+                                  "order_by": order_by,
+                                  "dir": "b" if reverse else None
+                              }, limit=page_size)
+
+    def federation_destination_details(self, destination):
+        """ Get the federation status of a remote server
+
+        Returns:
+            string: JSON string containing the admin API's response or None if
+                an exception occured. See Synapse admin API docs for details.
+        """
+        return self.query("get", f"v1/federation/destinations/{destination}")
+
+    def federation_destination_reset(self, destination):
+        """ Reset the connection backoff of a remote server, so Synapse tries
+        to reach it again right away
+
+        Returns:
+            string: JSON string containing the admin API's response or None if
+                an exception occured. See Synapse admin API docs for details.
+        """
+        return self.query(
+            "post",
+            f"v1/federation/destinations/{destination}/reset_connection",
+            data={})
+
+    def federation_destination_reset_many(self, destinations, workers):
+        """ Reset the connection backoff of several remote servers
+        concurrently
+
+        Args:
+            destinations (iterable): server names, possibly a generator
+            workers (int): maximum number of concurrent requests
+
+        Yields:
+            tuple: (destination, response) in the order the requests
+                complete, response being None if an exception occured.
+        """
+        return self._concurrently(self.federation_destination_reset,
+                                  destinations, workers)
+
+    def background_updates_status(self):
+        """ Get the status of background database updates
+
+        Returns:
+            string: JSON string containing the admin API's response or None if
+                an exception occured. See Synapse admin API docs for details.
+        """
+        return self.query("get", "v1/background_updates/status")
+
+    def background_updates_enabled(self, enabled):
+        """ Pause or resume background database updates
+
+        Args:
+            enabled (bool): False pauses updates, True resumes them.
+
+        Returns:
+            string: JSON string containing the admin API's response or None if
+                an exception occured. See Synapse admin API docs for details.
+        """
+        return self.query("post", "v1/background_updates/enabled",
+                          data={"enabled": enabled})
+
+    def background_updates_start_job(self, job_name):
+        """ Schedule a background database update job
+
+        Args:
+            job_name (string): populate_stats_process_rooms or
+                regenerate_directory
+
+        Returns:
+            string: JSON string containing the admin API's response or None if
+                an exception occured. See Synapse admin API docs for details.
+        """
+        return self.query("post", "v1/background_updates/start_job",
+                          data={"job_name": job_name})
+
+    def background_updates_watch(self, interval):
+        """ Poll the status of background database updates and measure their
+        progress
+
+        Synapse only reports how many items the running update of each
+        database processed so far, not how many are left, so the rate is the
+        best measure of progress available.
+
+        Args:
+            interval (float): Seconds to wait between polls.
+
+        Yields:
+            tuple: (enabled, updates) after each poll; updates being a list
+                with a dict per database running an update, holding the
+                database and update name, the number of items processed, the
+                rate measured since the previous poll (None for a new update)
+                and Synapse's average rate, in items per second. (None, None)
+                is yielded if the status could not be fetched.
+        """
+        previous = {}
+        while True:
+            polled = time.monotonic()
+            status = self.background_updates_status()
+            if status is None or "current_updates" not in status:
+                yield None, None
+            else:
+                updates = []
+                for database, update in status["current_updates"].items():
+                    items = update.get("total_item_count", 0)
+                    rate = None
+                    last = previous.get(database)
+                    if last and last[0] == update["name"]:
+                        rate = round((items - last[1]) / (polled - last[2]),
+                                     2)
+                    previous[database] = (update["name"], items, polled)
+                    updates.append({
+                        "database": database,
+                        "update": update["name"],
+                        "items": items,
+                        "items_per_s": rate,
+                        "average_items_per_s": round(
+                            update.get("average_items_per_ms", 0) * 1000, 2)
+                    })
+                yield status.get("enabled"), updates
+            time.sleep(max(interval - (time.monotonic() - polled), 0))
@@ -23,14 +23,21 @@ import sys
 import logging
 import pprint
 import json
+import math
+import cProfile
+import pstats
+import tracemalloc
+import linecache
+import threading
 import click
 import yaml
 import tabulate
 from urllib.parse import urlparse
 import dns.resolver
 import re
+import time
 
-from synadm import api
+from synadm import api, store
 
 
 def humanize(data):
@@ -54,6 +61,59 @@ def json_pretty(data):
     return json.dumps(data, indent=4)
 
 
+def count_records(data):
+    """ Count the records in data passed to APIHelper.output.
+
+    This counts what a command outputs, not what it processed: a summary
+    of a bulk operation is a single record. Lists count as their number of
+    items. Dicts containing lists, like an
+    API response with a page of users, count as the items of those lists,
+    any other data as a single item.
+    """
+    if isinstance(data, list):
+        return len(data)
+    if isinstance(data, dict):
+        lists = [value for value in data.values() if isinstance(value, list)]
+        if lists:
+            return sum(len(value) for value in lists)
+    return 0 if data is None else 1
+
+
+def prometheus_labels(**labels):
+    """ Format labels of a metric in Prometheus' text exposition format.
+    """
+    escaped = {
+        name: str(value).replace("\\", "\\\\").replace('"', '\\"')
+        .replace("\n", "\\n")
+        for name, value in labels.items()
+    }
+    return "{" + ",".join(
+        f'{name}="{value}"' for name, value in escaped.items()
+    ) + "}"
+
+
+def percentiles(values, points=(50, 95, 99)):
+    """ Calculate percentiles using the nearest-rank method.
+
+    Args:
+        values (list): the measured values, e.g latencies
+        points (tuple): the percentiles to calculate, between 0 and 100
+
+    Returns:
+        dict: "p<point>" mapped to the value of each percentile, None if
+            there are no values.
+    """
+    values = sorted(values)
+    result = {}
+    for point in points:
+        if not values:
+            result[f"p{point}"] = None
+            continue
+        rank = max(math.ceil(point / 100 * len(values)), 1)
+        result[f"p{point}"] = values[rank - 1]
+    return result
+
+
 class APIHelper:
     """ API client enriched with CLI-level functions, used as a proxy to the
     client object.
@@ -81,18 +141,21 @@ class APIHelper:
         self.config = APIHelper.CONFIG.copy()
         self.config_path = os.path.expanduser(config_path)
         self.batch = batch
+        self.data_dir = os.path.expanduser("~/.local/share/synadm")
         self.api = None
         self.init_logger(verbose)
         self.requests_debug = False
         if verbose >= 3:
             self.requests_debug = True
         self.output_format_cli = output_format_cli  # override from cli
+        self.request_stats = None
+        self.records_output = 0
 
     def init_logger(self, verbose):
         """ Log both to console (defaults to WARNING) and file (DEBUG).
         """
-        log_path = os.path.expanduser("~/.local/share/synadm/debug.log")
-        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        log_path = os.path.join(self.data_dir, "debug.log")
+        os.makedirs(self.data_dir, exist_ok=True)
         log = logging.getLogger("synadm")
         log.setLevel(logging.DEBUG)
         file_handler = logging.FileHandler(log_path, encoding="utf-8")
@@ -163,6 +226,252 @@ class APIHelper:
         )
         return True
 
+    def use_transport(self, record=None, replay=None, replay_latency=False):
+        """ Record requests to or replay them from a cassette file.
+        """
+        if record:
+            transport = api.RecordingTransport(record)
+        elif replay:
+            transport = api.ReplayTransport(replay, replay_latency,
+                                            self.log)
+        else:
+            return
+        for client in (self.api, self.matrix_api, self.misc_request):
+            client.transport = transport
+
+    def enable_timings(self):
+        """ Collect the duration and size of all requests.
+        """
+        if self.request_stats is not None:
+            return
+        self.request_stats = api.RequestStats()
+        for client in (self.api, self.matrix_api, self.misc_request):
+            client.stats = self.request_stats
+
+    def timings(self):
+        """ Summarize the collected request statistics per endpoint.
+
+        Returns:
+            list: a dict per endpoint with request and error counts, latency
+                percentiles in milliseconds and transferred bytes, the
+                endpoint requests spent most time in first.
+        """
+        results = []
+        for endpoint, stats in self.request_stats.endpoints.items():
+            durations = stats["durations"]
+            errors = sum(
+                count for status, count in stats["statuses"].items()
+                if status is None or status >= 400
+            )
+            ttfb = percentiles(stats["ttfbs"], (50,))["p50"]
+            results.append(dict(
+                endpoint=endpoint,
+                requests=len(durations),
+                errors=errors,
+                total_s=round(sum(durations), 3),
+                **{point: round(value * 1000, 1)
+                   for point, value in percentiles(durations).items()},
+                ttfb_p50=round(ttfb * 1000, 1) if ttfb is not None else None,
+                sent=stats["sent"],
+                received=stats["received"]
+            ))
+        return sorted(results, key=lambda result: -result["total_s"])
+
+    def print_timings(self):
+        """ Print the request statistics to stderr, e.g when exiting.
+        """
+        results = self.timings()
+        if results:
+            click.echo("\nRequest timings (ms):", err=True)
+            click.echo(humanize(results), err=True)
+
+    METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+                      10, 30)
+
+    def write_metrics(self, path, command, duration, success):
+        """ Write request and job metrics to a file in the text format read
+        by node-exporter's textfile collector.
+
+        The file is written to a temporary file first and renamed, so the
+        collector never reads a partially written file.
+
+        Args:
+            path (string): The .prom file to write.
+            command (string): The command run, e.g "media purge"; all
+                metrics are labeled with it.
+            duration (float): How long the command ran, in seconds.
+            success (bool): Whether the command exited successfully.
+        """
+        lines = []
+
+        def family(name, metric_type, description):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        endpoints = sorted(self.request_stats.endpoints.items())
+
+        def labels(endpoint, **extra):
+            method, path = endpoint.split(" ", 1)
+            return prometheus_labels(command=command, method=method,
+                                     endpoint=path, **extra)
+
+        family("synadm_requests_total", "counter",
+               "Requests sent to the API per endpoint.")
+        for endpoint, stats in endpoints:
+            lines.append(f"synadm_requests_total{labels(endpoint)} "
+                         f"{len(stats['durations'])}")
+        family("synadm_request_errors_total", "counter",
+               "Failed requests per endpoint and status code; code is "
+               "\"none\" if no response was received.")
+        for endpoint, stats in endpoints:
+            for status, count in sorted(stats["statuses"].items(),
+                                        key=lambda item: str(item[0])):
+                if status is not None and status < 400:
+                    continue
+                code = "none" if status is None else status
+                lines.append(f"synadm_request_errors_total"
+                             f"{labels(endpoint, code=code)} {count}")
+        family("synadm_request_duration_seconds", "histogram",
+               "Duration of requests per endpoint.")
+        for endpoint, stats in endpoints:
+            durations = stats["durations"]
+            for bucket in self.METRIC_BUCKETS + ("+Inf",):
+                count = len(durations) if bucket == "+Inf" else sum(
+                    1 for value in durations if value <= bucket
+                )
+                lines.append(f"synadm_request_duration_seconds_bucket"
+                             f"{labels(endpoint, le=bucket)} {count}")
+            lines.append(f"synadm_request_duration_seconds_sum"
+                         f"{labels(endpoint)} {sum(durations):.6f}")
+            lines.append(f"synadm_request_duration_seconds_count"
+                         f"{labels(endpoint)} {len(durations)}")
+        family("synadm_response_bytes_total", "counter",
+               "Bytes of response bodies received per endpoint.")
+        for endpoint, stats in endpoints:
+            lines.append(f"synadm_response_bytes_total{labels(endpoint)} "
+                         f"{stats['received']}")
+
+        job = prometheus_labels(command=command)
+        family("synadm_output_records_total", "counter",
+               "Records output by the command, e.g users listed; a "
+               "summary counts as one record.")
+        lines.append(f"synadm_output_records_total{job} "
+                     f"{self.records_output}")
+        family("synadm_job_duration_seconds", "gauge",
+               "How long the command ran.")
+        lines.append(f"synadm_job_duration_seconds{job} {duration:.3f}")
+        family("synadm_job_success", "gauge",
+               "1 if the command exited successfully, 0 otherwise.")
+        lines.append(f"synadm_job_success{job} {int(success)}")
+        family("synadm_job_last_run_timestamp_seconds", "gauge",
+               "When the command finished, as a unix timestamp.")
+        lines.append(f"synadm_job_last_run_timestamp_seconds{job} "
+                     f"{time.time():.3f}")
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as handle:
+                handle.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, path)
+        except OSError as error:
+            self.log.error("%s while writing metrics file", error)
+
+    def start_profile(self, kind, path=None):
+        """ Profile CPU time or memory allocations until stop_profile().
+
+        Args:
+            kind (string): "cpu" to run cProfile, "mem" to trace memory
+                allocations with tracemalloc.
+            path (string): Where the pstats file or the allocation report is
+                written to. Defaults to a file in synadm's data directory.
+        """
+        self.profile_kind = kind
+        self.profile_path = path or os.path.join(
+            self.data_dir,
+            "profile.pstats" if kind == "cpu" else "profile-mem.txt"
+        )
+        if kind == "cpu":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            # Deep enough to reach synadm's frames from within requests,
+            # json or yaml.
+            tracemalloc.start(40)
+            self.profile_peak = (0, None)
+            self.profile_done = threading.Event()
+            self.profile_sampler = threading.Thread(target=self.sample_memory,
+                                                    daemon=True)
+            self.profile_sampler.start()
+
+    def sample_memory(self, interval=0.05):
+        """ Keep a snapshot of the traced memory taken close to its peak
+        until stop_profile() is called.
+
+        A new snapshot is only taken once traced memory grew by a tenth
+        beyond the previous one, which keeps the overhead of taking
+        snapshots bounded.
+        """
+        while not self.profile_done.wait(interval):
+            current = tracemalloc.get_traced_memory()[0]
+            if current > self.profile_peak[0] * 1.1:
+                self.profile_peak = (current, tracemalloc.take_snapshot())
+
+    def stop_profile(self, top=20):
+        """ Stop profiling, write the results and print the top entries
+        attributed to synadm's own functions to stderr.
+
+        CPU profiles are sorted by cumulative time. Memory allocations held
+        when traced memory peaked are summed up per line of synadm code that
+        caused them, directly or by calling into other modules.
+        """
+        synadm_file = re.compile(r"[/\\]synadm[/\\]")
+        if self.profile_kind == "cpu":
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+            click.echo(f"\nCPU profile written to {self.profile_path}",
+                       err=True)
+            stats = pstats.Stats(self.profiler, stream=sys.stderr)
+            stats.sort_stats("cumulative").print_stats(
+                synadm_file.pattern, top
+            )
+            return
+
+        self.profile_done.set()
+        self.profile_sampler.join()
+        current, peak = tracemalloc.get_traced_memory()
+        held, memory = self.profile_peak
+        if memory is None or current > held:
+            held, memory = current, tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        memory = memory.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__)
+        ])
+        by_line = {}
+        for stat in memory.statistics("traceback"):
+            frames = [frame for frame in stat.traceback
+                      if synadm_file.search(frame.filename)]
+            if not frames:
+                continue
+            # Frames are ordered from the oldest to the most recent call.
+            key = (frames[-1].filename, frames[-1].lineno)
+            size, count = by_line.get(key, (0, 0))
+            by_line[key] = (size + stat.size, count + stat.count)
+        lines = [f"Peak traced memory: {peak / 1024:.1f} KiB",
+                 f"Top {top} lines of synadm code by memory held near the "
+                 f"peak ({held / 1024:.1f} KiB traced when sampled):"]
+        ranked = sorted(by_line.items(), key=lambda item: -item[1][0])
+        for (filename, lineno), (size, count) in ranked[:top]:
+            module = filename[synadm_file.search(filename).start() + 1:]
+            lines.append(f"{size / 1024:10.1f} KiB {count:8d} blocks  "
+                         f"{module}:{lineno}  "
+                         f"{linecache.getline(filename, lineno).strip()}")
+        text = "\n".join(lines)
+        with open(self.profile_path, "w") as handle:
+            handle.write(text + "\n")
+        click.echo(f"\nMemory report written to {self.profile_path}",
+                   err=True)
+        click.echo(text, err=True)
+
     def write_config(self, config):
         """ Write a new version of the configuration to file.
         """
@@ -186,8 +495,82 @@ class APIHelper:
     def output(self, data):
         """ Output data object using the configured formatter.
         """
+        self.records_output += count_records(data)
         click.echo(self.formatter(data))
 
+    def output_stream(self, data):
+        """ Output a single item of a (possibly long-running) stream of
+        results.
+
+        Unlike output(), every call produces self-contained output that can
+        be concatenated: JSON lines, YAML list items or, in human mode, a
+        single line of key/value pairs.
+        """
+        self.records_output += 1
+        if self.output_format == "json":
+            click.echo(json.dumps(data))
+        elif self.output_format == "yaml":
+            click.echo(yaml.dump([data]), nl=False)
+        elif self.output_format == "human" and isinstance(data, dict):
+            click.echo("  ".join(f"{k}: {v}" for k, v in data.items()))
+        else:
+            click.echo(self.formatter(data))
+
+    def offline_search(self, kind, term, limit, offset, min_score, refresh):
+        """ Search users or rooms in the local search index.
+
+        The index is built on first use and refreshed when requested by
+        streaming the complete user or room list. Only entries whose names
+        changed are re-indexed, and entries that vanished are removed.
+
+        Args:
+            kind (string): "user" or "room"
+            term (string): the search term
+            limit (int): maximum number of results
+            offset (int): skip this many results
+            min_score (float): minimum similarity, between 0 and 1
+            refresh (bool): update the index before searching
+
+        Returns:
+            list: matching users or rooms, best matches first; or None if
+                the index could not be built.
+        """
+        index = store.SearchIndex(os.path.join(self.data_dir, "search.db"))
+        try:
+            if refresh or index.is_empty(kind):
+                echo = self.log.info if self.batch else click.echo
+                echo(f"Refreshing {kind} search index...")
+                seen = int(time.time() * 1000)
+                if kind == "user":
+                    items = self.api.user_list_all()
+                else:
+                    items = self.api.room_list_all()
+                changed = 0
+                for item in items:
+                    if item is None:
+                        return None
+                    if kind == "user":
+                        changed += index.update(
+                            kind, item["name"], item.get("displayname"),
+                            None, seen)
+                    else:
+                        changed += index.update(
+                            kind, item["room_id"], item.get("name"),
+                            item.get("canonical_alias"), seen)
+                removed = index.remove_unseen(kind, seen)
+                index.commit()
+                echo(f"Re-indexed {changed} and removed {removed} "
+                     f"{kind}s.")
+            results = index.search(kind, term, limit, offset, min_score)
+        finally:
+            index.close()
+        if kind == "user":
+            return [{"name": r["key"], "displayname": r["name"],
+                     "score": r["score"]} for r in results]
+        return [{"room_id": r["key"], "name": r["name"],
+                 "canonical_alias": r["alias"], "score": r["score"]}
+                for r in results]
+
     def retrieve_homeserver_name(self, uri=None):
         """Try to retrieve the homeserver name.
 
@@ -282,6 +665,38 @@ class APIHelper:
             return None
 
 
+def command_name(ctx):
+    """ Return the name of the subcommand invoked, e.g "media purge".
+
+    Click doesn't keep the arguments of subcommands in the root context, so
+    the command line is parsed again, without running any callbacks.
+    """
+    names = []
+    try:
+        sub_ctx = ctx.command.make_context(
+            ctx.info_name, sys.argv[1:], resilient_parsing=True
+        )
+        while isinstance(sub_ctx.command, click.MultiCommand):
+            args = sub_ctx.protected_args + sub_ctx.args
+            if not args:
+                break
+            name, command, args = sub_ctx.command.resolve_command(
+                sub_ctx, args
+            )
+            if command is None:
+                break
+            names.append(name)
+            sub_ctx = command.make_context(
+                name, args, parent=sub_ctx, resilient_parsing=True
+            )
+    except click.ClickException:
+        pass
+    if not names or names[0] != ctx.invoked_subcommand:
+        # Not invoked from the command line, e.g in tests.
+        return ctx.invoked_subcommand or ""
+    return " ".join(names)
+
+
 @click.group(
     invoke_without_command=False,
     context_settings=dict(help_option_names=["-h", "--help"]))
@@ -308,12 +723,75 @@ class APIHelper:
     "--config-file", "-c", type=click.Path(),
     default="~/.config/synadm.yaml",
     help="Configuration file path.", show_default=True)
+@click.option(
+    "--record", type=click.Path(dir_okay=False),
+    help="""Append all requests and their responses to this cassette file.
+    Access tokens and passwords are not recorded.""")
+@click.option(
+    "--replay", type=click.Path(exists=True, dir_okay=False),
+    help="""Don't contact the server but answer requests with the responses
+    recorded in this cassette file.""")
+@click.option(
+    "--replay-latency", is_flag=True, default=False,
+    help="""When replaying, wait as long as each request originally took
+    instead of answering immediately.""")
+@click.option(
+    "--timings", is_flag=True, default=False,
+    help="""Print the number, latency percentiles and transferred bytes of
+    requests per API endpoint when the command finishes.""")
+@click.option(
+    "--profile", type=click.Choice(["cpu", "mem"]),
+    help="""Run the command under cProfile (cpu) and write a pstats file, or
+    trace memory allocations (mem) and write a report of the lines of code
+    holding most memory when memory use peaked. The top entries in synadm's
+    code are printed to stderr as well.""")
+@click.option(
+    "--profile-file", type=click.Path(dir_okay=False),
+    help="""Where --profile writes its results to. Defaults to profile.pstats
+    or profile-mem.txt in ~/.local/share/synadm.""")
+@click.option(
+    "--metrics-file", type=click.Path(dir_okay=False),
+    help="""Write request counts, errors and latencies per API endpoint,
+    the number of output records and the duration of the command to this
+    file in Prometheus' text format, e.g for node-exporter's textfile
+    collector.""")
 @click.pass_context
-def root(ctx, verbose, batch, output, config_file):
+def root(ctx, verbose, batch, output, config_file, record, replay,
+         replay_latency, timings, profile, profile_file, metrics_file):
     """ the Matrix-Synapse admin CLI
     """
+    if record and replay:
+        click.echo("--record and --replay can't be used together.")
+        raise SystemExit(1)
     ctx.obj = APIHelper(config_file, verbose, batch, output)
+    if profile:
+        ctx.obj.start_profile(profile, profile_file)
+        ctx.call_on_close(ctx.obj.stop_profile)
     helper_loaded = ctx.obj.load()
+    if helper_loaded:
+        ctx.obj.use_transport(record, replay, replay_latency)
+        if timings:
+            ctx.obj.enable_timings()
+            ctx.call_on_close(ctx.obj.print_timings)
+        if metrics_file:
+            ctx.obj.enable_timings()
+            command = command_name(ctx)
+            started = time.monotonic()
+
+            def write_metrics():
+                # Click exits successful commands with Exit(0) as well, any
+                # other exception (Abort, KeyboardInterrupt, a crash) or exit
+                # code means failure.
+                error = sys.exc_info()[1]
+                if isinstance(error, click.exceptions.Exit):
+                    success = error.exit_code == 0
+                elif isinstance(error, SystemExit):
+                    success = error.code in (0, None)
+                else:
+                    success = error is None
+                ctx.obj.write_metrics(metrics_file, command,
+                                      time.monotonic() - started, success)
+            ctx.call_on_close(write_metrics)
     if ctx.invoked_subcommand != "config" and not helper_loaded:
         if batch:
             click.echo("Please setup synadm: " + sys.argv[0] + " config.")
@@ -478,4 +956,4 @@ def version(helper):
 
 
 # Import additional commands
-from synadm.cli import room, user, media, group, history, matrix, regtok, notice  # noqa: F401, E402, E501
+from synadm.cli import room, user, media, group, history, matrix, regtok, notice, snapshot, device, report, federation, server, bench  # noqa: F401, E402, E501
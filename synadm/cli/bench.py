@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# synadm
+# Copyright (C) 2021 Callum Brown
+#
+# synadm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# synadm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Benchmark CLI command
+"""
+
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import click
+
+from synadm import cli
+
+
+@cli.root.command(name="bench")
+@click.option(
+    "--endpoint", "-e", "endpoints", multiple=True, type=click.Choice(
+        ["version", "user_list", "room_list", "room_details"]),
+    default=["version"], show_default=True,
+    help="""Endpoint to send requests to. Use several times to mix
+    endpoints, they are requested in turns.""")
+@click.option(
+    "--concurrency", "-j", type=click.IntRange(min=1), default=4,
+    show_default=True,
+    help="Number of requests sent in parallel.")
+@click.option(
+    "--duration", "-d", type=click.FloatRange(min=1), default=10,
+    show_default=True,
+    help="Number of seconds to send requests for.")
+@click.option(
+    "--limit", "-l", type=int, default=100, show_default=True,
+    help="Number of items requested per user_list or room_list request.")
+@click.pass_obj
+def bench_cmd(helper, endpoints, concurrency, duration, limit):
+    """ Measure throughput and latency of read-only API endpoints.
+
+    Sends requests using synadm's own API client, so the numbers match what
+    other synadm commands experience. room_details requests the details of
+    the rooms on the first page of the room list in turns. Failed requests
+    are counted as errors and not included in the latencies, which are
+    given in milliseconds.
+    """
+    calls = {
+        "version": helper.api.version,
+        "user_list": lambda: helper.api.user_list(0, limit, True, True,
+                                                  None, None),
+        "room_list": lambda: helper.api.room_list(0, limit, None, None,
+                                                  False),
+    }
+    if "room_details" in endpoints:
+        rooms = helper.api.room_list(0, limit, None, None, False)
+        if not rooms or not rooms.get("rooms"):
+            click.echo("Rooms for room_details could not be fetched.")
+            raise SystemExit(1)
+        room_ids = itertools.cycle([room["room_id"]
+                                    for room in rooms["rooms"]])
+        calls["room_details"] = lambda: helper.api.room_details(
+            next(room_ids))
+
+    lock = threading.Lock()
+    turns = itertools.cycle(endpoints)
+    latencies = {endpoint: [] for endpoint in endpoints}
+    errors = dict.fromkeys(endpoints, 0)
+
+    def worker(deadline):
+        while time.monotonic() < deadline:
+            with lock:
+                endpoint = next(turns)
+            start = time.perf_counter()
+            response = calls[endpoint]()
+            latency = (time.perf_counter() - start) * 1000
+            with lock:
+                if response is None or "errcode" in response:
+                    errors[endpoint] += 1
+                else:
+                    latencies[endpoint].append(latency)
+
+    if helper.output_format == "human":
+        click.echo(f"Sending requests for {duration:g} seconds...")
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker, started + duration)
+    elapsed = time.monotonic() - started
+
+    results = []
+    for endpoint in endpoints:
+        values = latencies[endpoint]
+        stats = cli.percentiles(values)
+        results.append(dict(
+            endpoint=endpoint,
+            requests=len(values) + errors[endpoint],
+            errors=errors[endpoint],
+            requests_per_s=round(len(values) / elapsed, 2),
+            **{point: round(value, 1) if value is not None else None
+               for point, value in stats.items()},
+            max=round(max(values), 1) if values else None
+        ))
+    helper.output(results)
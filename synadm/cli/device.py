@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# synadm
+# Copyright (C) 2021 Callum Brown
+#
+# synadm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# synadm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Device-related CLI commands
+"""
+
+import heapq
+import time
+import click
+
+from synadm import cli
+
+
+@cli.root.group()
+def device():
+    """ Inspect the devices of all users
+    """
+
+
+@device.command(name="report")
+@click.option(
+    "--top", "-k", type=click.IntRange(min=1), default=20, show_default=True,
+    help="Number of users with the most devices to list.")
+@click.option(
+    "--buckets", "-b", type=str, default="1,7,30,90,365", show_default=True,
+    help="""Comma separated upper limits (in days) of the last seen age
+    buckets devices are counted in.""")
+@click.option(
+    "--stale-days", "-d", type=int, default=90, show_default=True,
+    help="""Devices not seen for this many days are counted as stale. This
+    matches the --min-days option of 'user prune-devices'.""")
+@click.option(
+    "--concurrency", "-j", type=click.IntRange(min=1), default=4,
+    show_default=True,
+    help="Number of users whose devices are fetched in parallel.")
+@click.pass_obj
+def device_report_cmd(helper, top, buckets, stale_days, concurrency):
+    """ Summarize the devices of all local users.
+
+    Counts devices by the time they were last seen and lists the users with
+    the most devices, including how many of them are stale. This helps to
+    estimate the effect of running 'user prune-devices' across the server.
+    Users are processed as they are listed, so memory usage only depends on
+    --top.
+    """
+    try:
+        limits = sorted(int(days) for days in buckets.split(","))
+    except ValueError:
+        click.echo("Buckets need to be a comma separated list of days.")
+        raise SystemExit(1)
+    labels = [f"<= {days}d" for days in limits]
+    labels += [f"> {limits[-1]}d", "never"]
+    ages = dict.fromkeys(labels, 0)
+    now = time.time() * 1000
+    day = 24 * 60 * 60 * 1000
+    summary = dict(users=0, users_with_devices=0, devices=0,
+                   stale_devices=0, max_devices=0, failed=0)
+    heap = []
+
+    def user_ids():
+        for user in helper.api.user_list_all():
+            if user is None:
+                click.echo("User list could not be fetched completely.")
+                summary["failed"] += 1
+                return
+            yield user["name"]
+
+    for user_id, devices in helper.api.user_devices_many(user_ids(),
+                                                         concurrency):
+        if devices is None or "devices" not in devices:
+            helper.log.error("fetching devices of %s failed", user_id)
+            summary["failed"] += 1
+            continue
+        summary["users"] += 1
+        count = len(devices["devices"])
+        if not count:
+            continue
+        stale = 0
+        for dev in devices["devices"]:
+            seen = dev.get("last_seen_ts")
+            if seen is None:
+                ages["never"] += 1
+                stale += 1
+                continue
+            age = (now - seen) / day
+            for limit, label in zip(limits, labels):
+                if age <= limit:
+                    ages[label] += 1
+                    break
+            else:
+                ages[labels[len(limits)]] += 1
+            if age > stale_days:
+                stale += 1
+        summary["users_with_devices"] += 1
+        summary["devices"] += count
+        summary["stale_devices"] += stale
+        summary["max_devices"] = max(summary["max_devices"], count)
+        entry = (count, stale, user_id)
+        if len(heap) < top:
+            heapq.heappush(heap, entry)
+        else:
+            heapq.heappushpop(heap, entry)
+
+    top_users = [dict(user_id=user_id, devices=count, stale_devices=stale)
+                 for count, stale, user_id in sorted(heap, reverse=True)]
+    if helper.output_format == "human":
+        helper.output(summary)
+        click.echo("\nDevices by last seen:")
+        helper.output([dict(last_seen=label, devices=count)
+                       for label, count in ages.items()])
+        click.echo("\nUsers with the most devices:")
+        helper.output(top_users)
+    else:
+        helper.output(dict(summary, last_seen=ages, top_users=top_users))
+    if summary["failed"]:
+        raise SystemExit(1)
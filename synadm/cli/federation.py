@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# synadm
+# Copyright (C) 2021 Callum Brown
+#
+# synadm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# synadm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Federation-related CLI commands
+"""
+
+import click
+
+from synadm import cli
+
+
+def readable_destination(helper, destination):
+    """ Replace the timestamps of a destination with human readable dates
+    """
+    for key in ("retry_last_ts", "failure_ts"):
+        if destination.get(key):
+            destination[key] = helper.api._datetime_from_timestamp(
+                destination[key], as_str=True)
+    return destination
+
+
+@cli.root.group()
+def federation():
+    """ Inspect and reset connections to remote servers
+    """
+
+
+@federation.command(name="destinations")
+@click.option(
+    "--from", "-f", "from_", type=int, default=0, show_default=True,
+    help="""Offset destination listing by given number. This option is used
+    for pagination.""")
+@click.option(
+    "--limit", "-l", type=int, default=100, show_default=True,
+    help="Maximum amount of destinations to return.")
+@click.option(
+    "--all", "-a", "all_destinations", is_flag=True, default=False,
+    help="""Stream all destinations instead of a single page. --from and
+    --limit are ignored.""")
+@click.option(
+    "--name", "-n", type=str,
+    help="Filter destinations by parts of their server name.")
+@click.option(
+    "--sort", "-s", type=click.Choice(
+        ["destination", "retry_last_ts", "retry_interval", "failure_ts",
+         "last_successful_stream_ordering"]),
+    help="The method in which to sort the returned list of destinations.")
+@click.option(
+    "--reverse", "-r", is_flag=True, default=False,
+    help="""Direction of destination order. If set it will reverse the sort
+    order of --sort method.""")
+@click.option(
+    "--unhealthy", "-u", is_flag=True, default=False,
+    help="""Only list destinations Synapse currently fails to reach, i.e
+    those with a failure_ts.""")
+@click.option(
+    "--datetime/--timestamp", "--dt/--ts", default=True,
+    help="""Display retry and failure times in a human readable format, or as
+    a unix timestamp in milliseconds.  [default: datetime].""")
+@click.pass_obj
+def destinations_cmd(helper, from_, limit, all_destinations, name, sort,
+                     reverse, unhealthy, datetime):
+    """ List remote servers and their federation backoff state.
+
+    To see which remote servers are unreachable for the longest time, use
+    e.g '--all --unhealthy --sort failure_ts'. With --all, destinations are
+    printed while they are fetched.
+    """
+    def show(destination):
+        return not unhealthy or destination.get("failure_ts")
+
+    if all_destinations:
+        failed = False
+        for destination in helper.api.federation_destinations_all(
+            name, sort, reverse
+        ):
+            if destination is None:
+                failed = True
+                break
+            if show(destination):
+                if datetime:
+                    readable_destination(helper, destination)
+                helper.output_stream(destination)
+        if failed:
+            click.echo("Destinations could not be fetched completely.")
+            raise SystemExit(1)
+        return
+
+    destinations = helper.api.federation_destinations(from_, limit, name,
+                                                      sort, reverse)
+    if destinations is None or "destinations" not in destinations:
+        click.echo("Destinations could not be fetched.")
+        raise SystemExit(1)
+    destinations["destinations"] = [
+        readable_destination(helper, destination) if datetime
+        else destination
+        for destination in destinations["destinations"] if show(destination)
+    ]
+    if helper.output_format == "human":
+        if destinations["destinations"]:
+            helper.output(destinations["destinations"])
+        if "next_token" in destinations:
+            click.echo("There are more destinations than shown, use "
+                       "'--from {}'".format(destinations["next_token"]))
+    else:
+        helper.output(destinations)
+
+
+@federation.command(name="details")
+@click.argument("destination", type=str)
+@click.option(
+    "--datetime/--timestamp", "--dt/--ts", default=True,
+    help="""Display retry and failure times in a human readable format, or as
+    a unix timestamp in milliseconds.  [default: datetime].""")
+@click.pass_obj
+def destination_details_cmd(helper, destination, datetime):
+    """ View the federation backoff state of a remote server.
+    """
+    details = helper.api.federation_destination_details(destination)
+    if details is None:
+        click.echo("Destination details could not be fetched.")
+        raise SystemExit(1)
+    if datetime:
+        readable_destination(helper, details)
+    helper.output(details)
+
+
+@federation.command(name="reset")
+@click.argument("destinations", nargs=-1, type=str)
+@click.option(
+    "--unhealthy", "-u", is_flag=True, default=False,
+    help="""Reset all destinations Synapse currently fails to reach instead
+    of the given ones.""")
+@click.option(
+    "--concurrency", "-j", type=click.IntRange(min=1), default=4,
+    show_default=True,
+    help="Number of destinations reset in parallel.")
+@click.pass_obj
+def reset_cmd(helper, destinations, unhealthy, concurrency):
+    """ Reset the connection backoff of remote servers.
+
+    Synapse waits increasingly long before retrying to reach a remote server
+    that failed. Resetting makes it try again right away, e.g after the
+    remote server was fixed. Pass one or more server names or --unhealthy.
+    """
+    if bool(destinations) == unhealthy:
+        click.echo("Either pass destinations or --unhealthy.")
+        raise SystemExit(1)
+    if unhealthy:
+        destinations = []
+        for destination in helper.api.federation_destinations_all(
+            order_by="failure_ts", reverse=True
+        ):
+            if destination is None:
+                click.echo("Destinations could not be fetched.")
+                raise SystemExit(1)
+            if destination.get("failure_ts"):
+                destinations.append(destination["destination"])
+        if not destinations:
+            click.echo("No unhealthy destinations found.")
+            return
+
+    sure = (
+        helper.batch or
+        click.prompt("Are you sure you want to reset the connection backoff "
+                     "of {} destinations? (y/N)".format(len(destinations)),
+                     type=bool, default=False, show_default=False)
+    )
+    if not sure:
+        click.echo("Abort.")
+        return
+    failed = 0
+    for destination, response in (
+        helper.api.federation_destination_reset_many(destinations,
+                                                     concurrency)
+    ):
+        if response is None or response:
+            failed += 1
+            helper.output_stream(dict(destination=destination,
+                                      reset=False, response=response))
+        else:
+            helper.output_stream(dict(destination=destination, reset=True))
+    if failed:
+        click.echo(f"Resetting {failed} destinations failed.")
+        raise SystemExit(1)
@@ -109,24 +109,58 @@ def history_purge_cmd(helper, room_id, before_event_id, before_days, before,
 
 
 @history.command(name="purge-status")
-@click.argument("purge_id", type=str)
+@click.argument("purge_ids", metavar="PURGE_ID...", type=str, nargs=-1,
+                required=True)
+@click.option(
+    "--wait", "-w", is_flag=True, default=False,
+    help="""Keep polling until all given purges are either complete or
+    failed.""")
+@click.option(
+    "--interval", "-i", type=float, default=2, show_default=True,
+    help="""Seconds to wait between the first polling rounds when --wait is
+    used. The interval doubles after each round (with some randomness added)
+    until --max-interval is reached.""")
+@click.option(
+    "--max-interval", "-m", type=float, default=60, show_default=True,
+    help="""Maximum seconds to wait between polling rounds.""")
+@click.option(
+    "--timeout", "-t", type=int, default=None,
+    help="""Give up waiting after this number of seconds.  [default: wait
+    forever]""")
 @click.pass_obj
-def history_purge_status_cmd(helper, purge_id):
-    """ View status of a recent history purge. Provide purge ID as argument.
-
-    The status will be one of active, complete, or failed.
+def history_purge_status_cmd(helper, purge_ids, wait, interval, max_interval,
+                             timeout):
+    """ View status of recent history purges. Provide purge IDs as arguments.
+
+    The status will be one of active, complete, or failed. Using --wait,
+    several purges can be watched at once until they are finished; the
+    command then exits with an error if any of them failed or didn't finish
+    in time.
     """
-    purge_history_status = helper.api.purge_history_status(purge_id)
-    if helper.batch:
-        if purge_history_status is None:
-            raise SystemExit(1)
-        helper.output(purge_history_status)
+    if not wait:
+        statuses = (
+            (purge_id, helper.api.purge_history_status(purge_id))
+            for purge_id in purge_ids
+        )
     else:
+        statuses = helper.api.purge_history_status_wait(
+            purge_ids, interval, max_interval, timeout)
+
+    failed = False
+    for purge_id, purge_history_status in statuses:
         if purge_history_status is None:
-            click.echo("History purge status could not be fetched.")
-            raise SystemExit(1)
-        if "status" in purge_history_status:
-            click.echo("Status of history purge is {}.".format(
-                purge_history_status["status"]))
+            failed = True
+            if not helper.batch:
+                click.echo("History purge status of {} could not be "
+                           "fetched.".format(purge_id))
+            continue
+        status = purge_history_status.get("status")
+        if wait and status != "complete":
+            failed = True
+        if helper.batch or status is None:
+            helper.output(dict(purge_id=purge_id, **purge_history_status))
         else:
-            helper.output(purge_history_status)
+            click.echo("Status of history purge {} is {}.".format(
+                purge_id, status))
+    if failed:
+        raise SystemExit(1)
@@ -18,12 +18,59 @@
 """ Media-related CLI commands
 """
 
+import os
+import json
+import heapq
+import time
 import click
 from click_option_group import optgroup
 from click_option_group import RequiredAnyOptionGroup, OptionGroup
 from click_option_group import RequiredMutuallyExclusiveOptionGroup
 
-from synadm import cli
+from synadm import cli, store
+
+
+def slice_timestamp(helper, timestamp):
+    """ Show timestamps of time slices human readable unless in batch mode
+    """
+    if helper.batch:
+        return timestamp
+    return helper.api._datetime_from_timestamp(timestamp, as_str=True)
+
+
+def error_message(response):
+    """ Get a one-line error message from an API response or error dict
+    """
+    if "errcode" in response:
+        return "{}: {}".format(response["errcode"], response.get("error"))
+    return response.get("error", str(response))
+
+
+def media_bulk(helper, action, from_file, concurrency, rate):
+    """ Process a file of mxc URIs and stream a result line per media
+    """
+    mxc_uris = [
+        line.strip() for line in from_file
+        if line.strip() and not line.startswith("#")
+    ]
+    server_name = helper.retrieve_homeserver_name(helper.config["base_url"])
+    failed = 0
+    for mxc_uri, response in helper.api.media_bulk(
+        action, mxc_uris, server_name, concurrency, rate
+    ):
+        if response is None:
+            result = "request failed"
+        elif "error" in response or "errcode" in response:
+            result = error_message(response)
+        else:
+            result = "ok"
+        if result != "ok":
+            failed += 1
+        helper.output_stream({"mxc": mxc_uri, "result": result})
+    if helper.output_format == "human":
+        click.echo(f"Processed {len(mxc_uris)} media, {failed} failed.")
+    if failed:
+        raise SystemExit(1)
 
 
 @cli.root.group()
@@ -110,16 +157,33 @@ def media_list_cmd(ctx, helper, room_id, user_id, from_, limit, sort, reverse,
     "--user-id", "-u", type=str,
     help="""All media uploaded by user with this matrix ID (@user:server) will
     be quarantined.""")
+@optgroup.option(
+    "--from-file", "-f", type=click.File("rt"),
+    help="""Quarantine all media listed in this file, one mxc URI
+    (mxc://server/media_id) per line. To read from stdin use "-" as the
+    filename argument.""")
 @click.option(
     "--server-name", "-s", type=str,
     help="""The server name of the media, mandatory when --media-id is used and
     _remote_ media should be processed. For locally stored media this option
     can be omitted.
     """)
+@click.option(
+    "--concurrency", "-j", type=click.IntRange(min=1), default=4,
+    show_default=True,
+    help="""Number of media processed in parallel with --from-file.""")
+@click.option(
+    "--rate", type=float, default=10, show_default=True,
+    help="""Maximum number of requests per second with --from-file. Use 0 for
+    no limit.""")
 @click.pass_obj
-def media_quarantine_cmd(helper, server_name, media_id, user_id, room_id):
+def media_quarantine_cmd(helper, server_name, media_id, user_id, room_id,
+                         from_file, concurrency, rate):
     """ Quarantine media in rooms, by users or by media ID
     """
+    if from_file:
+        media_bulk(helper, "quarantine", from_file, concurrency, rate)
+        return
     if media_id and not server_name:
         # We assume it is local media and fetch our own server name.
         fetched_name = helper.retrieve_homeserver_name(
@@ -143,11 +207,30 @@ def media_quarantine_cmd(helper, server_name, media_id, user_id, room_id):
 
 
 @media.command(name="protect")
-@click.argument("media_id", type=str)
+@click.argument("media_id", type=str, required=False)
+@click.option(
+    "--from-file", "-f", type=click.File("rt"),
+    help="""Protect all media listed in this file, one mxc URI
+    (mxc://server/media_id) per line, instead of MEDIA_ID. To read from stdin
+    use "-" as the filename argument.""")
+@click.option(
+    "--concurrency", "-j", type=click.IntRange(min=1), default=4,
+    show_default=True,
+    help="""Number of media processed in parallel with --from-file.""")
+@click.option(
+    "--rate", type=float, default=10, show_default=True,
+    help="""Maximum number of requests per second with --from-file. Use 0 for
+    no limit.""")
 @click.pass_obj
-def media_protect_cmd(helper, media_id):
+def media_protect_cmd(helper, media_id, from_file, concurrency, rate):
     """ Protect specific media from being quarantined
     """
+    if bool(media_id) == bool(from_file):
+        click.echo("Either MEDIA_ID or --from-file is required.")
+        raise SystemExit(1)
+    if from_file:
+        media_bulk(helper, "protect", from_file, concurrency, rate)
+        return
     media_protected = helper.api.media_protect(media_id)
     if media_protected is None:
         click.echo("Media could not be protected.")
@@ -174,15 +257,83 @@ def media_protect_cmd(helper, media_id):
     help="""Purge all media that was last accessed before this unix
     timestamp in ms.
     """)
+@optgroup.group(
+    "Time slices",
+    cls=OptionGroup,
+    help="")
+@optgroup.option(
+    "--slice-days", type=click.IntRange(min=1),
+    help="""Don't purge all media at once but in slices of this number of
+    days, starting with the oldest media. Recommended on servers with a large
+    remote media cache, where a single purge request might time out.""")
+@optgroup.option(
+    "--slice-start", type=click.DateTime(),
+    help="""Date/time the first slice starts at. Defaults to the creation date
+    of the oldest local user.""")
+@optgroup.option(
+    "--pause", type=float, default=0, show_default=True,
+    help="""Seconds to pause between slices, giving the server some room to
+    breathe.""")
+@optgroup.option(
+    "--resume", is_flag=True, default=False,
+    help="""Continue an interrupted sliced purge where it left off. A sliced
+    purge can be interrupted with Ctrl-C at any time.""")
 @click.pass_obj
-def media_purge_cmd(helper, before_days, before, before_ts):
+def media_purge_cmd(helper, before_days, before, before_ts, slice_days,
+                    slice_start, pause, resume):
     """ Purge old cached remote media
     """
-    media_purged = helper.api.purge_media_cache(before_days, before, before_ts)
-    if media_purged is None:
-        click.echo("Media cache could not be purged.")
-        raise SystemExit(1)
-    helper.output(media_purged)
+    if not slice_days:
+        if slice_start or resume:
+            click.echo("--slice-start and --resume require --slice-days.")
+            raise SystemExit(1)
+        media_purged = helper.api.purge_media_cache(before_days, before,
+                                                    before_ts)
+        if media_purged is None:
+            click.echo("Media cache could not be purged.")
+            raise SystemExit(1)
+        helper.output(media_purged)
+        return
+
+    state_path = os.path.join(helper.data_dir, "media_purge_state.json")
+    start_ts, deleted = None, 0
+    if resume:
+        try:
+            with open(state_path) as handle:
+                state = json.load(handle)
+            start_ts, deleted = state["next_ts"], state["deleted"]
+        except Exception as error:
+            helper.log.error("%s while reading %s", error, state_path)
+            raise SystemExit(1)
+
+    slices = helper.api.purge_media_cache_sliced(
+        before_days, before, before_ts, slice_days, slice_start, start_ts)
+    try:
+        for media_slice in slices:
+            response = media_slice["response"]
+            if response is None or "deleted" not in response:
+                click.echo("Media cache could not be purged.")
+                if response is not None:
+                    helper.output(response)
+                raise SystemExit(1)
+            deleted += response["deleted"]
+            with open(state_path, "w") as handle:
+                json.dump({"next_ts": media_slice["before_ts"],
+                           "deleted": deleted}, handle)
+            helper.output_stream({
+                "from": slice_timestamp(helper, media_slice["from_ts"]),
+                "before": slice_timestamp(helper, media_slice["before_ts"]),
+                "deleted": response["deleted"],
+            })
+            if pause:
+                time.sleep(pause)
+    except KeyboardInterrupt:
+        click.echo("Purge paused, continue with --resume.", err=True)
+        raise SystemExit(130)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    if helper.output_format == "human":
+        click.echo(f"Purged {deleted} cached remote media in total.")
 
 
 @media.command(name="delete")
@@ -206,6 +357,11 @@ def media_purge_cmd(helper, before_days, before, before_ts):
     "--before-ts", "-t", type=int,
     help="""Delete all media that was last accessed before this unix
     timestamp in ms.""")
+@optgroup.option(
+    "--from-file", "-f", type=click.File("rt"),
+    help="""Delete all media listed in this file, one mxc URI
+    (mxc://server/media_id) per line. To read from stdin use "-" as the
+    filename argument.""")
 @optgroup.group(
     "Additional switches",
     cls=OptionGroup,
@@ -220,11 +376,72 @@ def media_purge_cmd(helper, before_days, before, before_ts):
     (e.g user profile, room avatar). If set, these files will be
     deleted too. Not valid when a specific media is being deleted
     (--media-id)""")
+@optgroup.group(
+    "Time slices",
+    cls=OptionGroup,
+    help="")
+@optgroup.option(
+    "--slice-days", type=click.IntRange(min=1),
+    help="""Don't delete all media at once but in slices of this number of
+    days, starting with the oldest media. The number of deleted media is shown
+    after each slice. Not valid when a specific media is being deleted
+    (--media-id)""")
+@optgroup.option(
+    "--slice-start", type=click.DateTime(),
+    help="""Date/time the first slice starts at. Defaults to the creation date
+    of the oldest local user.""")
+@optgroup.option(
+    "--pause-factor", type=click.FloatRange(min=0), default=1.0,
+    show_default=True,
+    help="""Pause between slices for the time the previous slice took,
+    multiplied by this factor. The slower the server responds, the longer the
+    pause. Use 0 to disable pausing.""")
+@click.option(
+    "--dry-run", "-n", is_flag=True, default=False,
+    help="""Don't delete anything but show how many media (and bytes) of each
+    user would be deleted. This fetches the media lists of all local users,
+    which takes a while on large servers.""")
+@click.option(
+    "--concurrency", "-j", type=click.IntRange(min=1), default=4,
+    show_default=True,
+    help="""Number of users whose media lists are fetched (with --dry-run) or
+    media that is deleted (with --from-file) in parallel.""")
+@click.option(
+    "--rate", type=float, default=10, show_default=True,
+    help="""Maximum number of requests per second with --from-file. Use 0 for
+    no limit.""")
 @click.pass_obj
 def media_delete_cmd(helper, media_id, before_days, before, before_ts,
-                     size, delete_profiles):
+                     from_file, size, delete_profiles, slice_days,
+                     slice_start, pause_factor, dry_run, concurrency, rate):
     """ Delete media by ID, size or age
     """
+    if from_file:
+        if size or delete_profiles or slice_days or dry_run:
+            click.echo("--from-file can't be combined with --size, "
+                       "--delete-profiles, --slice-days or --dry-run.")
+            raise SystemExit(1)
+        media_bulk(helper, "delete", from_file, concurrency, rate)
+        return
+    if dry_run:
+        if media_id:
+            click.echo("Combination of --media-id and --dry-run not valid.")
+            raise SystemExit(1)
+        total_media, total_bytes = 0, 0
+        for plan in helper.api.media_delete_plan(
+            before_days, before, before_ts, size, delete_profiles, concurrency
+        ):
+            if plan is None:
+                click.echo("Media lists could not be fetched.")
+                raise SystemExit(1)
+            total_media += plan["media"]
+            total_bytes += plan["bytes"]
+            helper.output_stream(plan)
+        if helper.output_format == "human":
+            click.echo(f"{total_media} media ({total_bytes} bytes) would be "
+                       "deleted.")
+        return
+
     server_name = helper.retrieve_homeserver_name(helper.config["base_url"])
     if not server_name:
         media_deleted = None
@@ -235,6 +452,32 @@ def media_delete_cmd(helper, media_id, before_days, before, before_ts,
     elif media_id and size:
         click.echo("Combination of --media-id and --size not valid.")
         media_deleted = None
+    elif media_id and slice_days:
+        click.echo("Combination of --media-id and --slice-days not valid.")
+        media_deleted = None
+    elif slice_days:
+        slices = helper.api.media_delete_by_date_or_size_sliced(
+            server_name, before_days, before, before_ts, size,
+            delete_profiles, slice_days, slice_start, pause_factor
+        )
+        total = 0
+        for media_slice in slices:
+            response = media_slice["response"]
+            if response is None or "total" not in response:
+                click.echo("Media could not be deleted.")
+                if response is not None:
+                    helper.output(response)
+                raise SystemExit(1)
+            total += response["total"]
+            helper.output_stream({
+                "from": slice_timestamp(helper, media_slice["from_ts"]),
+                "before": slice_timestamp(helper, media_slice["before_ts"]),
+                "latency": round(media_slice["latency"], 3),
+                "total": response["total"],
+            })
+        if helper.output_format == "human":
+            click.echo(f"Deleted {total} local media in total.")
+        return
     elif media_id:
         media_deleted = helper.api.media_delete(server_name, media_id)
     else:
@@ -246,3 +489,230 @@ def media_delete_cmd(helper, media_id, before_days, before, before_ts,
         click.echo("Media could not be deleted.")
         raise SystemExit(1)
     helper.output(media_deleted)
+
+
+@media.command(name="download")
+@optgroup.group(
+    "Download media of",
+    cls=RequiredMutuallyExclusiveOptionGroup,
+    help="")
+@optgroup.option(
+    "--room-id", "-r", type=str,
+    help="""Download all media in room with this room ID ('!abcdefg').""")
+@optgroup.option(
+    "--user-id", "-u", type=str,
+    help="""Download all media uploaded by user with this matrix ID
+    (@user:server).""")
+@click.option(
+    "--directory", "-d", type=click.Path(file_okay=False), required=True,
+    help="""Save media to this directory. Each file is named after its media
+    ID and put in a subdirectory named after the media's server.""")
+@click.option(
+    "--concurrency", "-j", type=click.IntRange(min=1), default=4,
+    show_default=True,
+    help="""Number of media downloaded in parallel.""")
+@click.option(
+    "--chunk-size", type=int, default=64, show_default=True,
+    help="""Size of the chunks media is downloaded and written to disk in, in
+    KiB (1 KiB = 1024 bytes).""")
+@click.pass_obj
+def media_download_cmd(helper, room_id, user_id, directory, concurrency,
+                       chunk_size):
+    """ Download media of a room or a user for backup purposes
+
+    Media already present in the directory with a matching size is skipped,
+    thus repeated backups only download new media.
+    """
+    mxid = helper.generate_mxid(user_id)
+    if user_id and mxid is None:
+        click.echo("The user you specified is invalid.")
+        raise SystemExit(1)
+    downloaded, skipped, failed = 0, 0, 0
+    for mxc_uri, result in helper.api.media_backup(
+        room_id, mxid, directory, helper.matrix_api, concurrency,
+        chunk_size * 1024
+    ):
+        if mxc_uri is None:
+            click.echo("Media list could not be fetched.")
+            if result is not None:
+                helper.output(result)
+            raise SystemExit(1)
+        if result is None:
+            result = {"status": "failed"}
+        elif "status" not in result:
+            result = {"status": "failed", "error": error_message(result)}
+        if result["status"] == "downloaded":
+            downloaded += 1
+        elif result["status"] == "skipped":
+            skipped += 1
+        else:
+            failed += 1
+        helper.output_stream(dict(mxc=mxc_uri, **result))
+    if helper.output_format == "human":
+        click.echo(f"Downloaded {downloaded} media, skipped {skipped}, "
+                   f"{failed} failed.")
+    if failed:
+        raise SystemExit(1)
+
+
+@media.command(name="dedup-report")
+@click.option(
+    "--index", "-i", "index_path", type=click.Path(dir_okay=False),
+    help="""SQLite database keeping the hashes of already processed media, so
+    that subsequent runs only download and hash new media.  [default:
+    ~/.local/share/synadm/media_hashes.db]""")
+@click.option(
+    "--top", "-k", type=int, default=20, show_default=True,
+    help="""Number of groups of identical media shown, the ones wasting the
+    most storage first.""")
+@click.option(
+    "--ids", "ids_shown", type=click.IntRange(min=0), default=5,
+    show_default=True,
+    help="""Number of media IDs listed per group in human readable output,
+    followed by the number of further copies. Use 0 to list all. JSON and
+    YAML output always list all media IDs.""")
+@click.option(
+    "--processes", "-p", type=click.IntRange(min=1),
+    default=os.cpu_count(),
+    show_default="number of CPUs",
+    help="""Number of worker processes downloading and hashing media.""")
+@click.option(
+    "--concurrency", "-j", type=click.IntRange(min=1), default=4,
+    show_default=True,
+    help="""Number of users whose media lists are fetched in parallel.""")
+@click.option(
+    "--chunk-size", type=int, default=64, show_default=True,
+    help="""Size of the chunks media is downloaded and hashed in, in KiB
+    (1 KiB = 1024 bytes).""")
+@click.pass_obj
+def media_dedup_report_cmd(helper, index_path, top, ids_shown, processes,
+                           concurrency, chunk_size):
+    """ Find identical local media uploaded several times
+
+    Downloads all local media, calculates a hash of its content and reports
+    groups of identical media and how much storage could be reclaimed by
+    deduplication. Hashes are kept in a local index; running the report again
+    only processes media that is new since the last run.
+    """
+    index = store.MediaHashIndex(
+        index_path or os.path.join(helper.data_dir, "media_hashes.db"))
+    seen = int(time.time() * 1000)
+    hashed, failed = 0, 0
+    try:
+        for user_id, media, sha256 in helper.api.media_hash_scan(
+            helper.matrix_api,
+            lambda media_id, length: index.is_hashed(media_id, length, seen),
+            concurrency, processes, chunk_size * 1024
+        ):
+            if user_id is None:
+                click.echo("Media lists could not be fetched.")
+                raise SystemExit(1)
+            if sha256 is None:
+                helper.log.warning("Media %s could not be downloaded.",
+                                   media["media_id"])
+                failed += 1
+                continue
+            index.add(media["media_id"], user_id, media["media_length"],
+                      sha256, seen)
+            hashed += 1
+            if hashed % 1000 == 0:
+                index.commit()
+                helper.log.info("%d media hashed.", hashed)
+    finally:
+        index.commit()
+
+    human = helper.output_format == "human"
+    duplicates = index.duplicates(seen, top,
+                                  ids_shown if human and ids_shown else None)
+    summary = dict(index.summary(seen), hashed=hashed, failed=failed)
+    index.close()
+    if human:
+        for group in duplicates:
+            more = group["copies"] - len(group["media_ids"])
+            group["media_ids"] = " ".join(group["media_ids"]) + (
+                f" (+{more} more)" if more else "")
+        if duplicates:
+            helper.output(duplicates)
+        click.echo("{media} media ({bytes} bytes) in total, {hashed} newly "
+                   "hashed, {failed} could not be downloaded.".format(
+                       **summary))
+        click.echo("{duplicate_media} media in {duplicate_groups} groups of "
+                   "identical media, {reclaimable_bytes} bytes could be "
+                   "reclaimed.".format(**summary))
+    else:
+        helper.output({"duplicates": duplicates, "summary": summary})
+
+
+@media.command(name="stats")
+@click.option(
+    "--by", "-b", "order_by", type=click.Choice(["media_length",
+                                                 "media_count"]),
+    default="media_length", show_default=True,
+    help="Rank users by the size or the number of their media.")
+@click.option(
+    "--top", "-k", type=click.IntRange(min=1), default=20,
+    show_default=True,
+    help="Number of users to show.")
+@click.option(
+    "--from-ts", type=int,
+    help="""Only count media uploaded at or after this unix timestamp in
+    ms.""")
+@click.option(
+    "--until-ts", type=int,
+    help="Only count media uploaded before this unix timestamp in ms.")
+@click.option(
+    "--aggregate", "-a", is_flag=True, default=False,
+    help="""Sum up the media lists of all users instead of using the
+    statistics API. This is done automatically if the statistics API is not
+    available.""")
+@click.option(
+    "--concurrency", "-j", type=click.IntRange(min=1), default=4,
+    show_default=True,
+    help="""Number of users whose media lists are fetched in parallel with
+    --aggregate.""")
+@click.pass_obj
+def media_stats_cmd(helper, order_by, top, from_ts, until_ts, aggregate,
+                    concurrency):
+    """ Show the users using the most media storage
+
+    Totals are calculated over all users with local media in a single pass,
+    keeping only the top users in memory.
+    """
+    def users_media():
+        if not aggregate:
+            stats = helper.api.user_media_statistics_all(from_ts, until_ts)
+            first = next(stats, False)
+            if first is False:
+                return
+            if first is not None:
+                yield first
+                yield from stats
+                return
+            click.echo("Media statistics API not available, aggregating "
+                       "media lists instead.")
+        yield from helper.api.local_users_media_statistics(
+            concurrency, from_ts, until_ts)
+
+    summary = dict(users=0, media_count=0, media_length=0)
+    heap = []
+    for count, stats in enumerate(users_media()):
+        if stats is None:
+            click.echo("Media statistics could not be fetched.")
+            raise SystemExit(1)
+        summary["users"] += 1
+        summary["media_count"] += stats["media_count"]
+        summary["media_length"] += stats["media_length"]
+        entry = (stats[order_by], count, stats)
+        if len(heap) < top:
+            heapq.heappush(heap, entry)
+        else:
+            heapq.heappushpop(heap, entry)
+
+    top_users = [stats for _, _, stats in sorted(heap, reverse=True)]
+    if helper.output_format == "human":
+        if top_users:
+            helper.output(top_users)
+        click.echo("{users} users uploaded {media_count} media "
+                   "({media_length} bytes) in total.".format(**summary))
+    else:
+        helper.output({"top_users": top_users, "summary": summary})
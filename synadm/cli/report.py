@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# synadm
+# Copyright (C) 2021 Callum Brown
+#
+# synadm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# synadm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Event report-related CLI commands
+"""
+
+from collections import Counter
+import click
+
+from synadm import cli
+
+
+@cli.root.group()
+def report():
+    """ Triage events reported by users
+    """
+
+
+@report.command(name="list")
+@click.option(
+    "--from", "-f", "from_", type=int, default=0, show_default=True,
+    help="""Offset report listing by given number. This option is used for
+    pagination.""")
+@click.option(
+    "--limit", "-l", type=int, default=100, show_default=True,
+    help="Maximum amount of reports to return.")
+@click.option(
+    "--all", "-a", "all_reports", is_flag=True, default=False,
+    help="""Stream all reports instead of a single page. --from and --limit
+    are ignored.""")
+@click.option(
+    "--user-id", "-u", type=str,
+    help="Only list reports by this user.")
+@click.option(
+    "--room-id", "-r", type=str,
+    help="Only list reports of events in this room.")
+@click.option(
+    "--reverse", is_flag=True, default=False,
+    help="List the oldest reports first.")
+@click.option(
+    "--details", "-d", is_flag=True, default=False,
+    help="""Fetch the details of each report, including the reported event.
+    With --all, reports are then printed in the order their details arrive.
+    """)
+@click.option(
+    "--summary", "-s", is_flag=True, default=False,
+    help="""Instead of the reports, show the number of reports per room and
+    per sender of the reported events.""")
+@click.option(
+    "--top", "-k", type=click.IntRange(min=1), default=20,
+    show_default=True,
+    help="Number of rooms and senders shown with --summary.")
+@click.option(
+    "--concurrency", "-j", type=click.IntRange(min=1), default=4,
+    show_default=True,
+    help="Number of report details fetched in parallel with --details.")
+@click.pass_obj
+def list_report_cmd(helper, from_, limit, all_reports, user_id, room_id,
+                    reverse, details, summary, top, concurrency):
+    """ List reported events, newest first.
+
+    With --all, reports are printed as they are fetched, so even huge
+    moderation queues can be processed with little memory. --summary helps
+    to spot raids: it counts reports per room and per sender of the
+    reported event.
+    """
+    mxid = helper.generate_mxid(user_id)
+    if all_reports:
+        reports = helper.api.event_report_list_all(reverse, mxid, room_id)
+    else:
+        page = helper.api.event_report_list(from_, limit, reverse, mxid,
+                                            room_id)
+        if page is None or "event_reports" not in page:
+            click.echo("Reports could not be fetched.")
+            raise SystemExit(1)
+        if not details and not summary:
+            if helper.output_format == "human":
+                if page["event_reports"]:
+                    helper.output(page["event_reports"])
+                if "next_token" in page:
+                    click.echo("There are more reports than shown, use "
+                               "'--from {}'".format(page["next_token"]))
+            else:
+                helper.output(page)
+            return
+        reports = iter(page["event_reports"])
+
+    failed = 0
+    if details:
+        def report_ids(listed):
+            nonlocal failed
+            for event_report in listed:
+                if event_report is None:
+                    failed += 1
+                    return
+                yield event_report["id"]
+
+        def detailed(listed):
+            nonlocal failed
+            for report_id, event_report in (
+                helper.api.event_report_details_many(report_ids(listed),
+                                                     concurrency)
+            ):
+                if event_report is None or "event_id" not in event_report:
+                    helper.log.error("fetching details of report %s failed",
+                                     report_id)
+                    failed += 1
+                    continue
+                yield event_report
+
+        reports = detailed(reports)
+
+    rooms, senders = Counter(), Counter()
+    for event_report in reports:
+        if event_report is None:
+            failed += 1
+            break
+        if summary:
+            rooms[event_report["room_id"]] += 1
+            senders[event_report["sender"]] += 1
+        else:
+            helper.output_stream(event_report)
+
+    if summary:
+        by_room = [dict(room_id=room, reports=count)
+                   for room, count in rooms.most_common(top)]
+        by_sender = [dict(sender=sender, reports=count)
+                     for sender, count in senders.most_common(top)]
+        if helper.output_format == "human":
+            click.echo("{} reports in {} rooms by {} senders.".format(
+                sum(rooms.values()), len(rooms), len(senders)))
+            if by_room:
+                helper.output(by_room)
+                helper.output(by_sender)
+        else:
+            helper.output(dict(rooms=by_room, senders=by_sender))
+    if failed:
+        click.echo("Reports could not be fetched completely.")
+        raise SystemExit(1)
+
+
+@report.command(name="details")
+@click.argument("report_id", type=int)
+@click.pass_obj
+def report_details_cmd(helper, report_id):
+    """ View details of a report, including the reported event.
+    """
+    event_report = helper.api.event_report_details(report_id)
+    if event_report is None:
+        click.echo("Report details could not be fetched.")
+        raise SystemExit(1)
+    helper.output(event_report)
@@ -290,14 +290,196 @@ def delete(ctx, helper, room_id, new_room_user_id, room_name, message, block,
     "--reverse", "-r", is_flag=True, default=False,
     help="""Direction of room order. If set it will reverse the sort order of
     --order-by method.""")
+@click.option(
+    "--offline", is_flag=True, default=False,
+    help="""Search the local search index instead of the server. The index
+    matches similar spellings too and is built on first use.""")
+@click.option(
+    "--refresh", is_flag=True, default=False,
+    help="""Update the local search index before searching. Implies
+    --offline.""")
+@click.option(
+    "--min-score", type=click.FloatRange(0, 1), default=0.4,
+    show_default=True,
+    help="""Minimum similarity of offline search results, where 1 means the
+    search term is fully contained.""")
 @click.pass_context
-def search_room_cmd(ctx, search_term, from_, limit, sort, reverse):
+def search_room_cmd(ctx, search_term, from_, limit, sort, reverse, offline,
+                    refresh, min_score):
     """ An alias to `synadm room list -n <search-term>`.
+
+    With --offline, rooms are looked up in a local trigram index of room
+    names and canonical aliases instead, which is instant, case-insensitive
+    and tolerates typos. Results are ranked by similarity, so --sort and
+    --reverse are ignored. Use --refresh to bring the index up to date.
     """
+    if offline or refresh:
+        helper = ctx.obj
+        rooms = helper.offline_search("room", search_term, limit, from_,
+                                      min_score, refresh)
+        if rooms is None:
+            click.echo("Search index could not be built.")
+            raise SystemExit(1)
+        helper.output(rooms)
+        return
     ctx.invoke(list_room_cmd, from_=from_, limit=limit, name=search_term,
                sort=sort, reverse=reverse)
 
 
+@room.command(name="top")
+@click.option(
+    "--by", "-b", "order_by", type=click.Choice(
+        ["state_events", "joined_members", "joined_local_members"]),
+    default="state_events", show_default=True,
+    help="The counter rooms are ranked by.")
+@click.option(
+    "--top", "-k", type=click.IntRange(min=1), default=50,
+    show_default=True,
+    help="Number of rooms to show.")
+@click.option(
+    "--details", "-d", is_flag=True, default=False,
+    help="""Fetch the details of each listed room (e.g topic and creator)
+    instead of showing the room list's fields only.""")
+@click.option(
+    "--concurrency", "-j", type=click.IntRange(min=1), default=4,
+    show_default=True,
+    help="Number of room details fetched in parallel with --details.")
+@click.pass_obj
+def top_room_cmd(helper, order_by, top, details, concurrency):
+    """ List the heaviest rooms, e.g those with the most state events.
+
+    Rooms with a lot of state events or members are usually the ones that
+    slow down Synapse. Only as many rooms as requested are fetched, so this
+    is quick even on servers with a huge number of rooms.
+    """
+    rooms = helper.api.room_top(order_by, top)
+    if rooms is None:
+        click.echo("Rooms could not be fetched.")
+        raise SystemExit(1)
+    if details:
+        fetched = dict(helper.api.room_details_many(
+            (room["room_id"] for room in rooms), concurrency))
+        for room in rooms:
+            if fetched[room["room_id"]] is None:
+                helper.log.error("fetching details of %s failed",
+                                 room["room_id"])
+            else:
+                room.update(fetched[room["room_id"]])
+    helper.output(rooms)
+
+
+@room.command(name="extremities")
+@click.argument("room_id", type=str, required=False)
+@click.option(
+    "--all", "-a", "all_rooms", is_flag=True, default=False,
+    help="""Scan all rooms on the server instead of a single room.""")
+@click.option(
+    "--threshold", "-t", type=click.IntRange(min=1), default=10,
+    show_default=True,
+    help="""With --all, only report rooms with at least this many forward
+    extremities.""")
+@click.option(
+    "--top", "-k", type=click.IntRange(min=1), default=50,
+    show_default=True,
+    help="With --all, number of rooms to show.")
+@click.option(
+    "--clear", is_flag=True, default=False,
+    help="""Delete the forward extremities of the room or, with --all, of all
+    rooms reaching the threshold.""")
+@click.option(
+    "--concurrency", "-j", type=click.IntRange(min=1), default=4,
+    show_default=True,
+    help="Number of rooms processed in parallel with --all.")
+@click.pass_obj
+def extremities_room_cmd(helper, room_id, all_rooms, threshold, top, clear,
+                         concurrency):
+    """ Check rooms for a large number of forward extremities.
+
+    Lots of forward extremities make Synapse slow when handling events of a
+    room. Either show the extremities of ROOM_ID or, with --all, scan all
+    rooms and list those with the most extremities.
+
+    --clear deletes all extremities but the latest, which is mostly useful
+    in rooms where extremities keep accumulating due to a bug.
+    """
+    if bool(room_id) == all_rooms:
+        click.echo("Either pass a room ID or --all.")
+        raise SystemExit(1)
+
+    scan = dict(failed=0)
+    if room_id:
+        extremities = helper.api.room_forward_extremities(room_id)
+        if extremities is None:
+            click.echo("Forward extremities could not be fetched.")
+            raise SystemExit(1)
+        helper.output(extremities)
+        if not clear:
+            return
+        room_ids = [room_id]
+    else:
+        def room_ids_all():
+            for room in helper.api.room_list_all():
+                if room is None:
+                    click.echo("Room list could not be fetched completely.")
+                    scan["failed"] += 1
+                    return
+                yield room["room_id"]
+
+        offenders = []
+        for scanned_id, extremities in (
+            helper.api.room_forward_extremities_many(room_ids_all(),
+                                                     concurrency)
+        ):
+            if extremities is None or "count" not in extremities:
+                helper.log.error("fetching forward extremities of %s failed",
+                                 scanned_id)
+                scan["failed"] += 1
+            elif extremities["count"] >= threshold:
+                offenders.append({"room_id": scanned_id,
+                                  "extremities": extremities["count"]})
+        offenders.sort(key=lambda room: room["extremities"], reverse=True)
+        if helper.output_format == "human":
+            click.echo("{} rooms have at least {} forward extremities."
+                       .format(len(offenders), threshold))
+        if offenders:
+            helper.output(offenders[:top])
+        room_ids = [room["room_id"] for room in offenders]
+        if scan["failed"]:
+            click.echo(f"Scan incomplete, {scan['failed']} requests "
+                       "failed.")
+        if not clear or not room_ids:
+            if scan["failed"]:
+                raise SystemExit(1)
+            return
+
+    sure = (
+        helper.batch or
+        click.prompt("Are you sure you want to delete the forward "
+                     "extremities of {} rooms? (y/N)".format(len(room_ids)),
+                     type=bool, default=False, show_default=False)
+    )
+    if not sure:
+        click.echo("Abort.")
+        if scan["failed"]:
+            raise SystemExit(1)
+        return
+    failed = 0
+    for cleared_id, deleted in helper.api.room_forward_extremities_many(
+        room_ids, concurrency, delete=True
+    ):
+        if deleted is None or "deleted" not in deleted:
+            failed += 1
+            helper.log.error("deleting forward extremities of %s failed",
+                             cleared_id)
+            continue
+        helper.output_stream({"room_id": cleared_id, **deleted})
+    if failed:
+        click.echo(f"Deleting forward extremities failed for {failed} "
+                   "rooms.")
+    if failed or scan["failed"]:
+        raise SystemExit(1)
+
+
 @room.command()
 @click.argument("room_id", type=str)
 @click.option(
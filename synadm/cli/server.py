@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# synadm
+# Copyright (C) 2021 Callum Brown
+#
+# synadm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# synadm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Server maintenance-related CLI commands
+"""
+
+import time
+import click
+
+from synadm import cli
+
+
+@cli.root.group()
+def server():
+    """ Monitor and control server maintenance tasks
+    """
+
+
+@server.command(name="background-updates")
+@click.option(
+    "--watch", "-w", is_flag=True, default=False,
+    help="""Keep polling the status until all updates are finished (or
+    interrupted using Ctrl-C) and show their progress rate.""")
+@click.option(
+    "--interval", "-i", type=click.FloatRange(min=1), default=10,
+    show_default=True,
+    help="Seconds to wait between polls with --watch.")
+@click.option(
+    "--pause/--resume", default=None,
+    help="""Pause background updates, e.g while the server is under heavy
+    load, or resume paused updates.""")
+@click.option(
+    "--start-job", type=click.Choice(["populate_stats_process_rooms",
+                                      "regenerate_directory"]),
+    help="""Schedule a job that repopulates room statistics or the user
+    directory.""")
+@click.pass_obj
+def background_updates_cmd(helper, watch, interval, pause, start_job):
+    """ Show the status of background database updates.
+
+    Synapse runs background updates after upgrades, which can slow it down
+    for hours. They can be paused and resumed, and their progress can be
+    watched. Synapse does not know how many items an update needs to process
+    in total, so there is no ETA, just the number of processed items and the
+    rate at which they are processed.
+    """
+    if pause is not None:
+        response = helper.api.background_updates_enabled(not pause)
+        if response is None or "enabled" not in response:
+            click.echo("Background updates could not be {}."
+                       .format("paused" if pause else "resumed"))
+            raise SystemExit(1)
+        helper.log.info("Background updates enabled: %s",
+                        response["enabled"])
+    if start_job:
+        response = helper.api.background_updates_start_job(start_job)
+        if response is None or response:
+            click.echo("Background update job could not be started.")
+            if response:
+                helper.output(response)
+            raise SystemExit(1)
+        helper.log.info("Background update job %s started.", start_job)
+
+    if not watch:
+        status = helper.api.background_updates_status()
+        if status is None:
+            click.echo("Background update status could not be fetched.")
+            raise SystemExit(1)
+        helper.output(status)
+        return
+
+    try:
+        for enabled, updates in helper.api.background_updates_watch(interval):
+            now = time.strftime("%Y-%m-%d %H:%M:%S")
+            if updates is None:
+                helper.log.warning("Background update status could not be "
+                                   "fetched, retrying.")
+                continue
+            for update in updates:
+                helper.output_stream(dict(time=now, enabled=enabled,
+                                          **update))
+            if enabled is False and not updates:
+                helper.output_stream(dict(time=now, enabled=enabled))
+            elif not updates:
+                if helper.output_format == "human":
+                    click.echo("No background updates are running.")
+                return
+    except KeyboardInterrupt:
+        raise SystemExit(130)
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# synadm
+# Copyright (C) 2020-2022 Johannes Tiefenbacher
+#
+# synadm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# synadm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Snapshot-related CLI commands
+"""
+
+import os
+import time
+import sqlite3
+import click
+
+from synadm import cli, store
+
+
+def snapshot_path(helper, db):
+    """ Get the path of the snapshot database, the default if db is None
+    """
+    return db or os.path.join(helper.data_dir, "snapshot.db")
+
+
+@cli.root.group()
+def snapshot():
+    """ Mirror users, rooms and media metadata into a local database
+
+    A snapshot is an SQLite database that can be queried offline, which is a
+    lot faster than paging through the admin API for every question.
+    """
+
+
+@snapshot.command(name="sync")
+@click.option(
+    "--db", "-d", type=click.Path(dir_okay=False),
+    help="""Path of the snapshot database. Keep several snapshots by using
+    different paths.  [default: ~/.local/share/synadm/snapshot.db]""")
+@click.option(
+    "--incremental", "-i", is_flag=True, default=False,
+    help="""Only fetch what changed since the last sync instead of replacing
+    everything. See below for details.""")
+@click.option(
+    "--details/--no-details", default=True, show_default=True,
+    help="""Fetch room details (e.g topic and avatar) in addition to the room
+    list. This needs a request per room.""")
+@click.option(
+    "--media/--no-media", default=True, show_default=True,
+    help="""Fetch the metadata of all local media. This needs at least a
+    request per user.""")
+@click.option(
+    "--concurrency", "-j", type=click.IntRange(min=1), default=4,
+    show_default=True,
+    help="""Number of room details and user media lists fetched in
+    parallel.""")
+@click.pass_obj
+def snapshot_sync_cmd(helper, db, incremental, details, media, concurrency):
+    """ Create or update a snapshot
+
+    By default all users, rooms and (optionally) media currently in the
+    snapshot are replaced. The snapshot is only changed if all data could be
+    fetched.
+
+    With --incremental, the time needed depends on how much changed rather
+    than on the size of the server:
+
+    \b
+      - Only users created after the newest user in the snapshot are
+        fetched. Note that changes to existing users (e.g deactivation) are
+        not picked up.
+      - The room list is fetched but room details only for rooms whose number
+        of state events or joined members changed. Rooms that vanished are
+        removed.
+      - Media lists are only fetched for users whose number of media
+        changed according to the media statistics API.
+    """
+    snap = store.Snapshot(snapshot_path(helper, db))
+    counts = {"users": 0, "rooms": 0, "media": 0}
+    incremental = incremental and not snap.is_empty()
+    if not incremental:
+        snap.clear()
+
+    def failed(what):
+        click.echo(f"{what} could not be fetched, snapshot not updated.")
+        raise SystemExit(1)
+
+    # Users
+    newest_ts = snap.newest_user_ts() if incremental else None
+    for user in helper.api.user_list_all(
+        order_by="creation_ts" if newest_ts else None, reverse=bool(newest_ts)
+    ):
+        if user is None:
+            failed("Users")
+        if newest_ts and (user.get("creation_ts") or 0) < newest_ts:
+            break
+        snap.add_user(user)
+        counts["users"] += 1
+
+    # Rooms
+    known_rooms = snap.room_counters() if incremental else {}
+
+    def changed_rooms():
+        for room in helper.api.room_list_all():
+            if room is None:
+                failed("Rooms")
+            counters = known_rooms.pop(room["room_id"], None)
+            if counters == (room["state_events"], room["joined_members"]):
+                continue
+            snap.add_room(room)
+            counts["rooms"] += 1
+            yield room["room_id"]
+
+    if details:
+        for room_id, room in helper.api.room_details_many(changed_rooms(),
+                                                          concurrency):
+            if room is None or "room_id" not in room:
+                failed(f"Details of room {room_id}")
+            snap.add_room(room)
+    else:
+        for room_id in changed_rooms():
+            pass
+    snap.remove_rooms(known_rooms)
+
+    # Media
+    if media and incremental:
+        media_counts = snap.media_counts()
+
+        def changed_users():
+            for stats in helper.api.user_media_statistics_all():
+                if stats is None:
+                    failed("Media statistics")
+                if media_counts.pop(stats["user_id"], 0) != \
+                        stats["media_count"]:
+                    yield stats["user_id"]
+            # Users left over don't have any media anymore.
+            yield from media_counts
+
+        for user_id, media_list in helper.api.user_media_many(
+            changed_users(), concurrency
+        ):
+            if media_list is None:
+                failed(f"Media of {user_id}")
+            snap.replace_user_media(user_id, media_list)
+            counts["media"] += len(media_list)
+    elif media:
+        for user, media_list in helper.api.local_users_media(concurrency):
+            if media_list is None:
+                failed("Media")
+            for item in media_list:
+                snap.add_media(user["name"], item)
+                counts["media"] += 1
+
+    snap.set_meta("synced_at", int(time.time() * 1000))
+    snap.close()
+    if helper.output_format == "human":
+        click.echo("{} {users} users, {rooms} rooms and {media} media.".format(
+            "Updated" if incremental else "Fetched", **counts))
+    else:
+        helper.output(counts)
+
+
+@snapshot.command(name="query")
+@click.argument("sql", type=str)
+@click.option(
+    "--db", "-d", type=click.Path(dir_okay=False, exists=True),
+    help="""Path of the snapshot database.  [default:
+    ~/.local/share/synadm/snapshot.db]""")
+@click.pass_obj
+def snapshot_query_cmd(helper, sql, db):
+    """ Query a snapshot using SQL
+
+    The snapshot is opened read-only. It has the tables users, rooms and
+    media with a column for each commonly used field the admin API returns,
+    e.g:
+
+    \b
+        synadm snapshot query "SELECT room_id, name, joined_members
+            FROM rooms WHERE joined_members > 1000 AND encryption IS NULL"
+
+    The complete API response for each item is available as JSON in the data
+    column of each table and can be used with SQLite's JSON functions, e.g
+    json_extract(data, '$.avatar').
+    """
+    path = snapshot_path(helper, db)
+    if not os.path.exists(path):
+        click.echo("Snapshot not found, create one with 'synadm snapshot "
+                   "sync'.")
+        raise SystemExit(1)
+    snap = store.Snapshot(path, readonly=True)
+    try:
+        rows = snap.query(sql)
+    except sqlite3.Error as error:
+        click.echo(f"Query failed: {error}")
+        raise SystemExit(1)
+    finally:
+        snap.close()
+    helper.output(rows)
+
+
+@snapshot.command(name="diff")
+@click.argument("old", type=click.Path(dir_okay=False, exists=True))
+@click.argument("new", type=click.Path(dir_okay=False, exists=True))
+@click.pass_obj
+def snapshot_diff_cmd(helper, old, new):
+    """ Show what changed between two snapshots
+
+    Lists users that appeared, vanished, were deactivated or reactivated or
+    were granted or revoked admin permission, as well as rooms that appeared,
+    vanished, or changed their membership or settings (e.g join rules or
+    encryption). Create the snapshots using 'synadm snapshot sync --db'.
+    """
+    snap = store.Snapshot(new, readonly=True)
+    try:
+        diff = snap.diff(old)
+    except sqlite3.Error as error:
+        click.echo(f"Snapshots could not be compared: {error}")
+        raise SystemExit(1)
+    finally:
+        snap.close()
+    if helper.output_format == "human":
+        for change, items in diff.items():
+            click.echo("{} ({}):".format(change.replace("_", " ").capitalize(),
+                                         len(items)))
+            if items:
+                helper.output(items)
+            click.echo()
+    else:
+        helper.output(diff)
@@ -18,11 +18,13 @@
 """ User-related CLI commands
 """
 
+import os
+import time
 import click
 from click_option_group import optgroup, MutuallyExclusiveOptionGroup
 from click_option_group import RequiredAnyOptionGroup
 
-from synadm import cli
+from synadm import cli, store
 
 
 # helper function to retrieve functions from within this package from another
@@ -281,14 +283,41 @@ def membership(helper, user_id, aliases):
 @click.option(
     "--limit", "-l", type=int, default=100, show_default=True,
     help="Maximum amount of users to return.")
+@click.option(
+    "--offline", is_flag=True, default=False,
+    help="""Search the local search index instead of the server. The index
+    matches similar spellings too and is built on first use.""")
+@click.option(
+    "--refresh", is_flag=True, default=False,
+    help="""Update the local search index before searching. Implies
+    --offline.""")
+@click.option(
+    "--min-score", type=click.FloatRange(0, 1), default=0.4,
+    show_default=True,
+    help="""Minimum similarity of offline search results, where 1 means the
+    search term is fully contained.""")
 @click.pass_context
-def user_search_cmd(ctx, search_term, from_, limit):
+def user_search_cmd(ctx, search_term, from_, limit, offline, refresh,
+                    min_score):
     """ A shortcut to \'synadm user list -d -g -n <search-term>\'.
 
     Searches for users by name/matrix-ID, including deactivated users as well
     as guest users. Also, compared to the original command, a case-insensitive
     search is done.
+
+    With --offline, users are looked up in a local trigram index of
+    matrix-IDs and display names instead, which is instant, case-insensitive
+    and tolerates typos. Use --refresh to bring it up to date.
     """
+    if offline or refresh:
+        helper = ctx.obj
+        users = helper.offline_search("user", search_term, limit, from_,
+                                      min_score, refresh)
+        if users is None:
+            click.echo("Search index could not be built.")
+            raise SystemExit(1)
+        helper.output(users)
+        return
     click.echo("User search results for '{}':".format(search_term.lower()))
     ctx.invoke(list_user_cmd, from_=from_, limit=limit,
                name=search_term.lower(), deactivated=True, guests=True)
@@ -438,6 +467,108 @@ def whois(helper, user_id):
     helper.output(user_data)
 
 
+@user.command(name="inactive")
+@click.option(
+    "--days", "-d", type=click.IntRange(min=1), required=True,
+    help="Report users that have not been seen for this many days.")
+@click.option(
+    "--cache-days", type=click.FloatRange(min=0), default=1,
+    show_default=True,
+    help="""Trust the cached result of inactive users that were checked less
+    than this many days ago instead of asking Synapse again. Use 0 to check
+    all of them again.""")
+@click.option(
+    "--guests", "-g", is_flag=True, default=False,
+    help="Include guest users.")
+@click.option(
+    "--concurrency", "-j", type=click.IntRange(min=1), default=4,
+    show_default=True,
+    help="Number of users checked in parallel.")
+@click.option(
+    "--datetime/--timestamp", "--dt/--ts", default=True,
+    help="""Display 'last seen date/time' in a human readable format, or as a
+    unix timestamp in milliseconds.  [default: datetime].""")
+@click.pass_obj
+def user_inactive_cmd(helper, days, cache_days, guests, concurrency,
+                      datetime):
+    """ Find users that have not been seen for a number of days.
+
+    Checks the sessions of all active (not deactivated) users using the whois
+    API and lists those whose last connection is older than --days. Users
+    created within --days are skipped. Results are printed as soon as they
+    are known.
+
+    Last seen times are cached in ~/.local/share/synadm/last_seen.db. Users
+    known to have been seen within --days are skipped on subsequent runs
+    until that time has passed, so periodic runs only need to check a
+    fraction of all users.
+
+    Note that Synapse forgets connections after user_ips_max_age (28 days by
+    default). Users without any known connection are listed with an empty
+    last seen time.
+    """
+    day = 24 * 60 * 60 * 1000
+    now = int(time.time() * 1000)
+    cutoff = now - days * day
+    cache = store.LastSeenCache(os.path.join(helper.data_dir, "last_seen.db"))
+    pending = {}
+    failed = 0
+
+    def report(user, last_seen, cached):
+        if last_seen and datetime:
+            last_seen = helper.api._datetime_from_timestamp(last_seen,
+                                                            as_str=True)
+        helper.output_stream({
+            "user_id": user["name"],
+            "displayname": user.get("displayname"),
+            "last_seen": last_seen or None,
+            "cached": cached
+        })
+
+    def candidates():
+        nonlocal failed
+        for user in helper.api.user_list_all(guests=guests,
+                                             deactivated=False):
+            if user is None:
+                click.echo("User list could not be fetched completely.")
+                failed += 1
+                return
+            created = user.get("creation_ts") or 0
+            if created < 1e11:
+                created *= 1000  # older Synapse versions use seconds
+            if created > cutoff:
+                continue
+            cached = cache.get(user["name"])
+            if cached and cached[0] > cutoff:
+                continue
+            if cached and cached[1] > now - cache_days * day:
+                report(user, cached[0], True)
+                continue
+            pending[user["name"]] = user
+            yield user["name"]
+
+    try:
+        for count, (user_id, last_seen) in enumerate(
+            helper.api.user_last_seen_many(candidates(), concurrency)
+        ):
+            user = pending.pop(user_id)
+            if last_seen is None:
+                helper.log.error("fetching whois information of %s failed",
+                                 user_id)
+                failed += 1
+                continue
+            cache.set(user_id, last_seen, now)
+            if last_seen <= cutoff:
+                report(user, last_seen, False)
+            if count % 100 == 99:
+                cache.commit()
+    finally:
+        cache.close()
+    if failed:
+        click.echo(f"Checking {failed} users failed.")
+        raise SystemExit(1)
+
+
 @user.command(name="media")
 @click.argument("user_id", type=str)
 @click.option(
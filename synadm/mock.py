@@ -0,0 +1,974 @@
+# -*- coding: utf-8 -*-
+# synadm
+# Copyright (C) 2020-2022 Johannes Tiefenbacher
+#
+# synadm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# synadm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Mock Synapse server
+
+A stand-in for Synapse's admin API and the parts of the Matrix API synadm
+uses, serving a synthetic dataset. It allows to try out and benchmark synadm
+without a homeserver, e.g:
+
+    python -m synadm.mock --users 1000000 --rooms 100000
+
+and point synadm's base URL to http://localhost:8008.
+
+Users, rooms, media and so on are not stored but derived from their index
+whenever they are requested, so even huge datasets need next to no memory
+and start instantly. As a consequence, most modifying requests are accepted
+but have no effect; only registration tokens, forward extremities and
+pausing background updates keep their changes.
+"""
+
+import re
+import json
+import time
+import threading
+import functools
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+import click
+
+
+DAY = 24 * 60 * 60 * 1000
+
+
+class Dataset:
+    """Synthetic users, rooms, media, reports and federation destinations
+
+    Every item is a function of its index, so nothing needs to be generated
+    upfront. Timestamps are relative to the time the dataset was created.
+    """
+
+    def __init__(self, server_name, users, rooms, media_per_user,
+                 heavy_state, reports, destinations):
+        self.server_name = server_name
+        self.users = users
+        self.rooms = rooms
+        self.media_per_user = media_per_user
+        self.heavy_state = heavy_state
+        self.reports = reports
+        self.destinations = destinations
+        self.now = int(time.time() * 1000)
+        self.lock = threading.Lock()
+        self.cleared_extremities = set()
+        self.background_updates_enabled = True
+        self.registration_tokens = {}
+
+    # Users
+
+    def user_id(self, index):
+        return f"@user{index:07d}:{self.server_name}"
+
+    def user_index(self, user_id):
+        match = re.match(r"^@user(\d+):(.+)$", user_id)
+        if not match or match.group(2) != self.server_name:
+            return None
+        index = int(match.group(1))
+        return index if index < self.users else None
+
+    @staticmethod
+    def user_is_deactivated(index):
+        return index % 50 == 49
+
+    @staticmethod
+    def user_is_guest(index):
+        return index % 100 == 99
+
+    def user(self, index):
+        return {
+            "name": self.user_id(index),
+            "user_type": None,
+            "is_guest": self.user_is_guest(index),
+            "admin": index == 0,
+            "deactivated": self.user_is_deactivated(index),
+            "shadow_banned": index % 1000 == 999,
+            "displayname": f"User {index}",
+            "avatar_url": (f"mxc://{self.server_name}/avatar{index:07d}"
+                           if index % 2 else None),
+            "creation_ts": self.now - (self.users - index) * 60 * 1000,
+            "approved": True,
+            "erased": False,
+            "last_seen_ts": self.user_last_seen(index),
+            "locked": False
+        }
+
+    def user_last_seen(self, index):
+        if index % 10 == 3:
+            return None
+        return self.now - (index * 7919 % 400) * DAY // 2
+
+    def user_media_count(self, index):
+        return (index * 31) % (2 * self.media_per_user + 1)
+
+    @staticmethod
+    def media_content(index, number):
+        """Return the length and the byte media consists of
+
+        Every fifth media of a user is one of 20 files uploaded by many
+        users, so media dedup-report finds duplicates.
+        """
+        if number % 5 == 4:
+            group = index % 20
+            return 2000 + group * 1000, group
+        return 1000 + (index * 7 + number * 104729) % 5000000, 20 + (
+            index + number) % 200
+
+    def media(self, index, number):
+        created = self.now - ((index + number) * 104729 % 730) * DAY
+        return {
+            "media_id": f"u{index:07d}m{number:05d}",
+            "media_type": ("image/png", "image/jpeg", "video/mp4",
+                           "application/pdf")[number % 4],
+            "media_length": self.media_content(index, number)[0],
+            "upload_name": f"upload{number}",
+            "created_ts": created,
+            "last_access_ts": created + (number % 30) * DAY,
+            "quarantined_by": None,
+            "safe_from_quarantine": False
+        }
+
+    def devices(self, index):
+        return [{
+            "device_id": f"DEVICE{number}",
+            "display_name": f"Device {number}",
+            "last_seen_ip": "192.0.2.1",
+            "last_seen_user_agent": "mock",
+            "last_seen_ts": (self.now - (index + number * 37) % 500 * DAY
+                             if number % 4 != 3 else None),
+            "user_id": self.user_id(index)
+        } for number in range(index % 7)]
+
+    def joined_rooms(self, index):
+        if not self.rooms:
+            return []
+        return sorted({self.room_id((index * 13 + number * 7) % self.rooms)
+                       for number in range(index % 5)})
+
+    # Rooms
+
+    def room_id(self, index):
+        return f"!room{index:07d}:{self.server_name}"
+
+    def room_index(self, room_id):
+        match = re.match(r"^!room(\d+):(.+)$", room_id)
+        if not match or match.group(2) != self.server_name:
+            return None
+        index = int(match.group(1))
+        return index if index < self.rooms else None
+
+    @staticmethod
+    def room_joined_members(index):
+        if index % 1000 == 7:
+            return 5000 + index % 20000
+        return 1 + (index * 7919) % 97
+
+    def room_state_events(self, index):
+        state_events = self.room_joined_members(index) + 8
+        if index % 5000 == 11:
+            state_events += self.heavy_state
+        return state_events
+
+    def room(self, index):
+        return {
+            "room_id": self.room_id(index),
+            "name": f"Room {index}",
+            "canonical_alias": (f"#room{index}:{self.server_name}"
+                                if index % 3 else None),
+            "joined_members": self.room_joined_members(index),
+            "joined_local_members": self.room_joined_members(index) // 2 + 1,
+            "version": "10",
+            "creator": self.user_id(index % max(self.users, 1)),
+            "encryption": "m.megolm.v1.aes-sha2" if index % 2 else None,
+            "federatable": True,
+            "public": index % 4 == 0,
+            "join_rules": "public" if index % 4 == 0 else "invite",
+            "guest_access": None,
+            "history_visibility": "shared",
+            "state_events": self.room_state_events(index),
+            "room_type": None
+        }
+
+    def room_details(self, index):
+        return dict(self.room(index), topic=f"Topic of room {index}",
+                    avatar=None, joined_local_devices=index % 10,
+                    forgotten=False)
+
+    def room_members(self, index):
+        count = min(self.room_joined_members(index), self.users)
+        return [self.user_id((index * 31 + number) % self.users)
+                for number in range(count)]
+
+    def room_state(self, index):
+        room_id = self.room_id(index)
+        creator = self.user_id(index % max(self.users, 1))
+        members = self.room_members(index)
+
+        def event(number, event_type, state_key, content, sender=creator):
+            return {
+                "type": event_type, "state_key": state_key,
+                "content": content, "room_id": room_id, "sender": sender,
+                "event_id": f"$room{index}state{number}",
+                "origin_server_ts": self.now - number * 1000,
+                "unsigned": {"age": number * 1000}
+            }
+
+        state = [
+            event(0, "m.room.create", "",
+                  {"creator": creator, "room_version": "10"}),
+            event(1, "m.room.name", "", {"name": f"Room {index}"}),
+            event(2, "m.room.power_levels", "", {
+                "users": {creator: 100},
+                "users_default": 0, "events_default": 0,
+                "state_default": 50, "ban": 50, "kick": 50, "redact": 50,
+                "invite": 0
+            }),
+        ]
+        state += [event(3 + number, "m.room.member", member,
+                        {"membership": "join"}, member)
+                  for number, member in enumerate(members)]
+        number = len(state)
+        while number < self.room_state_events(index):
+            state.append(event(number, "org.example.heavy", str(number),
+                               {"value": number}))
+            number += 1
+        return state
+
+    @functools.lru_cache(maxsize=16)
+    def room_order(self, order_by, reverse):
+        """The room indexes sorted like Synapse sorts the room list
+        """
+        keys = {
+            "joined_members": self.room_joined_members,
+            "joined_local_members":
+                lambda index: self.room_joined_members(index) // 2 + 1,
+            "state_events": self.room_state_events,
+        }
+        if order_by in keys:
+            # Synapse lists rooms with the highest counters first
+            return sorted(range(self.rooms), key=keys[order_by],
+                          reverse=not reverse)
+        if order_by == "name":
+            return sorted(range(self.rooms), key=lambda index: f"Room "
+                          f"{index}", reverse=reverse)
+        return list(range(self.rooms - 1, -1, -1) if reverse
+                    else range(self.rooms))
+
+    # Other
+
+    def forward_extremities(self, index):
+        if index in self.cleared_extremities:
+            return 1
+        return 1 + (index * 7) % 40 if index % 11 else 120
+
+    def report(self, index):
+        room = index % max(self.rooms, 1)
+        return {
+            "id": index,
+            "received_ts": self.now - (self.reports - index) * 60 * 1000,
+            "room_id": self.room_id(room),
+            "name": f"Room {room}",
+            "canonical_alias": None,
+            "event_id": f"$reported{index}",
+            "user_id": self.user_id(index % max(self.users, 1)),
+            "sender": self.user_id((index * 7) % max(self.users, 1)),
+            "reason": "spam",
+            "score": -100
+        }
+
+    def destination(self, index):
+        failing = index % 9 == 0
+        return {
+            "destination": f"server{index}.example.net",
+            "retry_last_ts": self.now - index * 1000 if failing else 0,
+            "retry_interval": index * 600 if failing else 0,
+            "failure_ts": self.now - index * 60000 if failing else None,
+            "last_successful_stream_ordering": index * 10
+        }
+
+
+def error(status, errcode, message):
+    return status, {"errcode": errcode, "error": message}
+
+
+def paginate(count, item, params, key, token_key, default_limit=100,
+             matches=None, total=None):
+    """Return a page of a list of count items
+
+    The token is the index of the next item, so pages can be served without
+    counting or skipping over filtered items first.
+    """
+    start = int(params.get("from", 0) or 0)
+    limit = int(params.get("limit", default_limit) or default_limit)
+    reverse = params.get("dir") == "b"
+    indexes = (range(count - 1 - start, -1, -1) if reverse
+               else range(start, count))
+    page, last = [], None
+    for position, index in enumerate(indexes):
+        if len(page) >= limit:
+            break
+        last = start + position
+        if matches is None or matches(index):
+            page.append(item(index))
+    else:
+        last = None
+    response = {key: page, "total": count if total is None else total}
+    if last is not None:
+        response[token_key] = last + 1
+    return response
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Route requests to the handler methods of the matching endpoint
+    """
+    server_version = "MockSynapse/1.0"
+    protocol_version = "HTTP/1.1"
+    routes = []
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def dispatch(self, method):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values
+                  in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            data = {}
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        token = self.server.token
+        if (token and not url.path.startswith("/_matrix/key/")
+                and self.headers.get("Authorization") != f"Bearer {token}"):
+            return self.respond(*error(401, "M_UNKNOWN_TOKEN",
+                                       "Invalid access token passed."))
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                args = [unquote(arg) for arg in match.groups()]
+                result = handler(self, self.server.dataset, params, data,
+                                 *args)
+                if isinstance(result, bytes):
+                    return self.respond_bytes(result)
+                return self.respond(*result)
+        self.respond(*error(404, "M_UNRECOGNIZED", "Unrecognized request"))
+
+    def respond(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond_bytes(self, body):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def route(method, path):
+    """Register a handler method for requests matching a path regex
+    """
+    def decorator(func):
+        MockHandler.routes.append((method, re.compile(f"^{path}$"), func))
+        return func
+    return decorator
+
+
+ADMIN = "/_synapse/admin"
+ID = r"([^/]+)"
+
+
+@route("GET", ADMIN + "/v1/server_version")
+def server_version(handler, ds, params, data):
+    return 200, {"server_version": "1.99.0 (mock)"}
+
+
+@route("GET", "/_matrix/key/v2/server")
+def server_keys(handler, ds, params, data):
+    return 200, {"server_name": ds.server_name, "verify_keys": {},
+                 "old_verify_keys": {}, "valid_until_ts": ds.now + DAY}
+
+
+@route("GET", ADMIN + "/v2/users")
+def user_list(handler, ds, params, data):
+    guests = params.get("guests", "true") == "true"
+    deactivated = params.get("deactivated") == "true"
+    name = params.get("name", "").lower()
+    user_id = params.get("user_id", "").lower()
+
+    def matches(index):
+        return ((guests or not ds.user_is_guest(index))
+                and (deactivated or not ds.user_is_deactivated(index))
+                and name in f"user{index:07d} user {index}"
+                and user_id in ds.user_id(index))
+
+    # Users are listed by index, which is both name and creation_ts order.
+    total = None
+    if not name and not user_id:
+        # Flags only depend on index % 100, count them per period.
+        period = sum(matches(index) for index in range(100))
+        rest = sum(matches(index)
+                   for index in range(ds.users - ds.users % 100, ds.users))
+        total = ds.users // 100 * period + rest
+    elif ds.users <= 100000:
+        total = sum(matches(index) for index in range(ds.users))
+    return 200, paginate(ds.users, ds.user, params, "users", "next_token",
+                         matches=matches, total=total)
+
+
+@route("GET", ADMIN + "/v2/users/" + ID)
+def user_details(handler, ds, params, data, user_id):
+    index = ds.user_index(user_id)
+    if index is None:
+        return error(404, "M_NOT_FOUND", "User not found")
+    return 200, dict(ds.user(index), threepids=[], external_ids=[])
+
+
+@route("PUT", ADMIN + "/v2/users/" + ID)
+def user_modify(handler, ds, params, data, user_id):
+    index = ds.user_index(user_id)
+    if index is None:
+        return 201, dict(data, name=user_id)
+    return 200, dict(ds.user(index), **data)
+
+
+@route("GET", ADMIN + "/v2/users/" + ID + "/devices")
+def user_devices(handler, ds, params, data, user_id):
+    index = ds.user_index(user_id)
+    devices = ds.devices(index) if index is not None else []
+    return 200, {"devices": devices, "total": len(devices)}
+
+
+@route("POST", ADMIN + "/v2/users/" + ID + "/delete_devices")
+def user_devices_delete(handler, ds, params, data, user_id):
+    return 200, {}
+
+
+@route("GET", ADMIN + "/v1/whois/" + ID)
+def user_whois(handler, ds, params, data, user_id):
+    index = ds.user_index(user_id)
+    if index is None:
+        return error(404, "M_NOT_FOUND", "User not found")
+    seen = ds.user_last_seen(index)
+    connections = [] if seen is None or seen < ds.now - 28 * DAY else [
+        {"ip": "192.0.2.1", "last_seen": seen, "user_agent": "mock"}]
+    return 200, {"user_id": user_id, "devices": {
+        "": {"sessions": [{"connections": connections}]}}}
+
+
+@route("GET", ADMIN + "/v1/users/" + ID + "/joined_rooms")
+def user_joined_rooms(handler, ds, params, data, user_id):
+    index = ds.user_index(user_id)
+    rooms = ds.joined_rooms(index) if index is not None else []
+    return 200, {"joined_rooms": rooms, "total": len(rooms)}
+
+
+@route("GET", ADMIN + "/v1/users/" + ID + "/media")
+def user_media(handler, ds, params, data, user_id):
+    index = ds.user_index(user_id)
+    count = ds.user_media_count(index) if index is not None else 0
+    return 200, paginate(count, functools.partial(ds.media, index), params,
+                         "media", "next_token")
+
+
+@route("GET", ADMIN + "/v1/statistics/users/media")
+def user_media_statistics(handler, ds, params, data):
+    from_ts = int(params.get("from_ts", 0))
+    until_ts = int(params.get("until_ts", 0)) or None
+
+    def statistics(index):
+        media = [ds.media(index, number)
+                 for number in range(ds.user_media_count(index))]
+        media = [item for item in media if item["created_ts"] >= from_ts and
+                 (until_ts is None or item["created_ts"] < until_ts)]
+        return {"user_id": ds.user_id(index),
+                "displayname": f"User {index}",
+                "media_count": len(media),
+                "media_length": sum(item["media_length"] for item in media)}
+
+    # Sorting is not supported, users are listed by index.
+    response = paginate(ds.users, statistics, params, "users", "next_token",
+                        matches=ds.user_media_count)
+    response["users"] = [user for user in response["users"]
+                         if user["media_count"]]
+    return 200, response
+
+
+@route("POST", ADMIN + "/v1/users/" + ID + "/login")
+def user_login(handler, ds, params, data, user_id):
+    return 200, {"access_token": "mock_token"}
+
+
+@route("GET", ADMIN + "/v1/rooms")
+def room_list(handler, ds, params, data):
+    order = ds.room_order(params.get("order_by"), params.get("dir") == "b")
+    search = params.get("search_term", "").lower()
+    if search:
+        order = [index for index in order
+                 if search in f"room {index} #room{index}:"]
+    response = paginate(len(order), lambda position: ds.room(order[position]),
+                        dict(params, dir=None), "rooms", "next_batch")
+    response["total_rooms"] = response.pop("total")
+    response["offset"] = int(params.get("from", 0) or 0)
+    return 200, response
+
+
+def room_handler(func):
+    """Look up the room index of the room ID in the path
+    """
+    @functools.wraps(func)
+    def wrapper(handler, ds, params, data, room_id, *args):
+        index = ds.room_index(room_id)
+        if index is None:
+            return error(404, "M_NOT_FOUND", "Room not found")
+        return func(handler, ds, params, data, index, *args)
+    return wrapper
+
+
+@route("GET", ADMIN + "/v1/rooms/" + ID)
+@room_handler
+def room_details(handler, ds, params, data, index):
+    return 200, ds.room_details(index)
+
+
+@route("DELETE", ADMIN + "/v1/rooms/" + ID)
+@room_handler
+def room_delete(handler, ds, params, data, index):
+    return 200, {"kicked_users": [], "failed_to_kick_users": [],
+                 "local_aliases": [], "new_room_id": None}
+
+
+@route("GET", ADMIN + "/v1/rooms/" + ID + "/members")
+@room_handler
+def room_members(handler, ds, params, data, index):
+    members = ds.room_members(index)
+    return 200, {"members": members, "total": len(members)}
+
+
+@route("GET", ADMIN + "/v1/rooms/" + ID + "/state")
+@room_handler
+def room_state(handler, ds, params, data, index):
+    return 200, {"state": ds.room_state(index)}
+
+
+@route("GET", ADMIN + "/v1/rooms/" + ID + "/forward_extremities")
+@room_handler
+def room_forward_extremities(handler, ds, params, data, index):
+    count = ds.forward_extremities(index)
+    return 200, {"count": count, "results": [{
+        "event_id": f"$room{index}extremity{number}", "state_group": number,
+        "depth": number, "received_ts": ds.now - number * 1000
+    } for number in range(count)]}
+
+
+@route("DELETE", ADMIN + "/v1/rooms/" + ID + "/forward_extremities")
+@room_handler
+def room_forward_extremities_delete(handler, ds, params, data, index):
+    count = ds.forward_extremities(index)
+    with ds.lock:
+        ds.cleared_extremities.add(index)
+    return 200, {"deleted": count - 1}
+
+
+@route("GET", ADMIN + "/v1/room/" + ID + "/media")
+@room_handler
+def room_media(handler, ds, params, data, index):
+    return 200, {"local": [
+        f"mxc://{ds.server_name}/u{index % max(ds.users, 1):07d}m{number:05d}"
+        for number in range(index % 4)], "remote": []}
+
+
+@route("POST", ADMIN + "/v1/rooms/" + ID + "/make_room_admin")
+@route("POST", ADMIN + "/v1/join/" + ID)
+def room_modify(handler, ds, params, data, room_id):
+    return 200, {"room_id": room_id}
+
+
+@route("POST", ADMIN + "/v1/purge_history/" + ID)
+def purge_history(handler, ds, params, data, room_id):
+    return 200, {"purge_id": f"purge{int(time.time() * 1000)}"}
+
+
+@route("GET", ADMIN + "/v1/purge_history_status/" + ID)
+def purge_history_status(handler, ds, params, data, purge_id):
+    return 200, {"status": "complete"}
+
+
+@route("POST", ADMIN + "/v1/purge_media_cache")
+def purge_media_cache(handler, ds, params, data):
+    return 200, {"deleted": 0}
+
+
+@route("POST", ADMIN + "/v1/media/" + ID + "/delete")
+def media_delete_by_date(handler, ds, params, data, server_name):
+    return 200, {"deleted_media": [], "total": 0}
+
+
+@route("DELETE", ADMIN + "/v1/media/" + ID + "/" + ID)
+def media_delete(handler, ds, params, data, server_name, media_id):
+    return 200, {"deleted_media": [media_id], "total": 1}
+
+
+@route("POST", ADMIN + "/v1/media/quarantine/" + ID + "/" + ID)
+@route("POST", ADMIN + "/v1/media/protect/" + ID)
+@route("POST", ADMIN + "/v1/room/" + ID + "/media/quarantine")
+@route("POST", ADMIN + "/v1/user/" + ID + "/media/quarantine")
+def media_modify(handler, ds, params, data, *args):
+    return 200, {}
+
+
+@route("GET", "/_matrix/client/v1/media/download/" + ID + "/" + ID)
+@route("GET", "/_matrix/media/v3/download/" + ID + "/" + ID)
+def media_download(handler, ds, params, data, server_name, media_id):
+    match = re.match(r"^u(\d+)m(\d+)$", media_id)
+    if server_name != ds.server_name or not match:
+        return error(404, "M_NOT_FOUND", "Not found")
+    length, content = ds.media_content(int(match.group(1)),
+                                       int(match.group(2)))
+    return bytes([content]) * length
+
+
+@route("GET", ADMIN + "/v1/event_reports")
+def event_reports(handler, ds, params, data):
+    # Synapse lists the newest reports first by default.
+    params = dict(params, dir="f" if params.get("dir") == "f" else "b")
+    room_id = params.get("room_id")
+    user_id = params.get("user_id")
+
+    def matches(index):
+        report = ds.report(index)
+        return ((not room_id or report["room_id"] == room_id)
+                and (not user_id or report["user_id"] == user_id))
+
+    return 200, paginate(ds.reports, ds.report, params, "event_reports",
+                         "next_token", matches=matches)
+
+
+@route("GET", ADMIN + r"/v1/event_reports/(\d+)")
+def event_report_details(handler, ds, params, data, report_id):
+    if int(report_id) >= ds.reports:
+        return error(404, "M_NOT_FOUND", "Event report not found")
+    report = ds.report(int(report_id))
+    return 200, dict(report, event_json={
+        "type": "m.room.message", "room_id": report["room_id"],
+        "sender": report["sender"], "event_id": report["event_id"],
+        "content": {"msgtype": "m.text", "body": "Buy now!"}})
+
+
+@route("GET", ADMIN + "/v1/federation/destinations")
+def destinations(handler, ds, params, data):
+    order_by = params.get("order_by")
+    search = params.get("destination", "")
+    if order_by in ("retry_last_ts", "retry_interval", "failure_ts",
+                    "last_successful_stream_ordering"):
+        order = sorted(range(ds.destinations), key=lambda index: (
+            ds.destination(index)[order_by] or 0))
+    else:
+        order = list(range(ds.destinations))
+    if search:
+        order = [index for index in order
+                 if search in ds.destination(index)["destination"]]
+    if params.get("dir") == "b":
+        order.reverse()
+    return 200, paginate(len(order),
+                         lambda position: ds.destination(order[position]),
+                         dict(params, dir=None), "destinations",
+                         "next_token")
+
+
+@route("GET", ADMIN + "/v1/federation/destinations/" + ID)
+def destination_details(handler, ds, params, data, destination):
+    match = re.match(r"^server(\d+)\.example\.net$", destination)
+    if not match or int(match.group(1)) >= ds.destinations:
+        return error(404, "M_NOT_FOUND", "Unknown destination")
+    return 200, ds.destination(int(match.group(1)))
+
+
+@route("POST", ADMIN + "/v1/federation/destinations/" + ID +
+       "/reset_connection")
+def destination_reset(handler, ds, params, data, destination):
+    match = re.match(r"^server(\d+)\.example\.net$", destination)
+    if not match or int(match.group(1)) >= ds.destinations:
+        return error(404, "M_NOT_FOUND", "Unknown destination")
+    if not ds.destination(int(match.group(1)))["retry_last_ts"]:
+        return error(400, "M_UNKNOWN", "The retry timing does not need to "
+                     "be reset for this destination.")
+    return 200, {}
+
+
+@route("GET", ADMIN + "/v1/background_updates/status")
+def background_updates_status(handler, ds, params, data):
+    return 200, {"enabled": ds.background_updates_enabled,
+                 "current_updates": {}}
+
+
+@route("POST", ADMIN + "/v1/background_updates/enabled")
+def background_updates_enabled(handler, ds, params, data):
+    ds.background_updates_enabled = bool(data.get("enabled", True))
+    return 200, {"enabled": ds.background_updates_enabled}
+
+
+@route("POST", ADMIN + "/v1/background_updates/start_job")
+def background_updates_start_job(handler, ds, params, data):
+    return 200, {}
+
+
+def registration_token_valid(token):
+    return ((token["uses_allowed"] is None
+             or token["completed"] + token["pending"] < token["uses_allowed"])
+            and (token["expiry_time"] is None
+                 or token["expiry_time"] > time.time() * 1000))
+
+
+@route("GET", ADMIN + "/v1/registration_tokens")
+def registration_tokens(handler, ds, params, data):
+    with ds.lock:
+        tokens = list(ds.registration_tokens.values())
+    if "valid" in params:
+        valid = params["valid"] == "true"
+        tokens = [token for token in tokens
+                  if registration_token_valid(token) == valid]
+    return 200, {"registration_tokens": tokens}
+
+
+@route("POST", ADMIN + "/v1/registration_tokens/new")
+def registration_token_new(handler, ds, params, data):
+    with ds.lock:
+        name = data.get("token") or (
+            f"mock{len(ds.registration_tokens):0{data.get('length', 16)}d}"
+        )
+        if name in ds.registration_tokens:
+            return error(400, "M_INVALID_PARAM",
+                         f"Token already exists: {name}")
+        ds.registration_tokens[name] = {
+            "token": name, "uses_allowed": data.get("uses_allowed"),
+            "pending": 0, "completed": 0,
+            "expiry_time": data.get("expiry_time")
+        }
+        return 200, ds.registration_tokens[name]
+
+
+@route("GET", ADMIN + "/v1/registration_tokens/" + ID)
+def registration_token_details(handler, ds, params, data, name):
+    with ds.lock:
+        if name not in ds.registration_tokens:
+            return error(404, "M_NOT_FOUND", "No such registration token")
+        return 200, ds.registration_tokens[name]
+
+
+@route("PUT", ADMIN + "/v1/registration_tokens/" + ID)
+def registration_token_update(handler, ds, params, data, name):
+    with ds.lock:
+        if name not in ds.registration_tokens:
+            return error(404, "M_NOT_FOUND", "No such registration token")
+        token = ds.registration_tokens[name]
+        token.update({key: value for key, value in data.items()
+                      if key in ("uses_allowed", "expiry_time")})
+        return 200, token
+
+
+@route("DELETE", ADMIN + "/v1/registration_tokens/" + ID)
+def registration_token_delete(handler, ds, params, data, name):
+    with ds.lock:
+        if ds.registration_tokens.pop(name, None) is None:
+            return error(404, "M_NOT_FOUND", "No such registration token")
+    return 200, {}
+
+
+@route("POST", ADMIN + "/v1/deactivate/" + ID)
+def user_deactivate(handler, ds, params, data, user_id):
+    if ds.user_index(user_id) is None:
+        return error(404, "M_NOT_FOUND", "User not found")
+    return 200, {"id_server_unbind_result": "success"}
+
+
+@route("POST", ADMIN + "/v1/reset_password/" + ID)
+@route("POST", ADMIN + "/v1/users/" + ID + "/shadow_ban")
+@route("DELETE", ADMIN + "/v1/users/" + ID + "/shadow_ban")
+def user_modify_other(handler, ds, params, data, user_id):
+    if ds.user_index(user_id) is None:
+        return error(404, "M_NOT_FOUND", "User not found")
+    return 200, {}
+
+
+@route("GET", ADMIN + "/v1/threepid/" + ID + "/users/" + ID)
+def user_by_threepid(handler, ds, params, data, medium, address):
+    match = re.match(r"^user(\d+)@", address)
+    if medium != "email" or not match or int(match.group(1)) >= ds.users:
+        return error(404, "M_NOT_FOUND", "User not found")
+    return 200, {"user_id": ds.user_id(int(match.group(1)))}
+
+
+@route("GET", ADMIN + "/v1/auth_providers/" + ID + "/users/" + ID)
+def user_by_external_id(handler, ds, params, data, provider, external_id):
+    match = re.match(r"^ext(\d+)$", external_id)
+    if not match or int(match.group(1)) >= ds.users:
+        return error(404, "M_NOT_FOUND", "User not found")
+    return 200, {"user_id": ds.user_id(int(match.group(1)))}
+
+
+@route("POST", ADMIN + "/v1/send_server_notice")
+def send_server_notice(handler, ds, params, data):
+    if ds.user_index(data.get("user_id", "")) is None:
+        return error(400, "M_UNKNOWN",
+                     "Server notices can only be sent to local users")
+    return 200, {"event_id": f"$notice{time.time_ns()}"}
+
+
+@route("POST", ADMIN + "/v1/delete_group/" + ID)
+def delete_group(handler, ds, params, data, group_id):
+    return 200, {}
+
+
+@route("POST", "/_matrix/client/r0/login")
+def login(handler, ds, params, data):
+    user = data.get("user", "")
+    if not user.startswith("@"):
+        user = f"@{user}:{ds.server_name}"
+    if ds.user_index(user) is None:
+        return error(403, "M_FORBIDDEN", "Invalid username or password")
+    return 200, {"user_id": user, "access_token": "mock_token",
+                 "device_id": "MOCKDEVICE", "home_server": ds.server_name}
+
+
+@route("GET", "/_matrix/client/r0/directory/room/" + ID)
+def room_alias(handler, ds, params, data, alias):
+    match = re.match(r"^#room(\d+):(.+)$", alias)
+    if (not match or match.group(2) != ds.server_name
+            or int(match.group(1)) >= ds.rooms
+            or not int(match.group(1)) % 3):
+        return error(404, "M_NOT_FOUND", f"Room alias {alias} not found")
+    return 200, {"room_id": ds.room_id(int(match.group(1))),
+                 "servers": [ds.server_name]}
+
+
+@route("GET", "/_matrix/client/r0/rooms/" + ID + "/aliases")
+@room_handler
+def room_aliases(handler, ds, params, data, index):
+    alias = ds.room(index)["canonical_alias"]
+    return 200, {"aliases": [alias] if alias else []}
+
+
+@route("GET", "/.well-known/matrix/server")
+def well_known(handler, ds, params, data):
+    return 200, {"m.server": f"{ds.server_name}:8448"}
+
+
+def make_server(host, port, dataset, token=None, latency=0, verbose=False):
+    """Create a server for a dataset; call serve_forever() to run it
+
+    Args:
+        host (string): Address to listen on.
+        port (int): Port to listen on, 0 to pick a free one.
+        dataset (Dataset): The data served.
+        token (string): Only accept requests using this access token.
+        latency (float): Seconds to wait before answering each request.
+        verbose (bool): Log every request.
+    """
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.dataset = dataset
+    server.token = token
+    server.latency = latency
+    server.verbose = verbose
+    return server
+
+
+@click.command()
+@click.option(
+    "--host", default="127.0.0.1", show_default=True,
+    help="Address to listen on.")
+@click.option(
+    "--port", "-p", type=int, default=8008, show_default=True,
+    help="Port to listen on.")
+@click.option(
+    "--server-name", "-n", default="example.org", show_default=True,
+    help="The homeserver name used in user IDs, room IDs and mxc URIs.")
+@click.option(
+    "--token", "-t", type=str,
+    help="""Only accept requests using this access token. By default any
+    token is accepted.""")
+@click.option(
+    "--users", "-u", type=click.IntRange(min=0), default=10000,
+    show_default=True,
+    help="Number of users.")
+@click.option(
+    "--rooms", "-r", type=click.IntRange(min=0), default=1000,
+    show_default=True,
+    help="Number of rooms.")
+@click.option(
+    "--media-per-user", "-m", type=click.IntRange(min=0), default=5,
+    show_default=True,
+    help="Average number of media uploaded per user.")
+@click.option(
+    "--heavy-state", type=click.IntRange(min=0), default=10000,
+    show_default=True,
+    help="Number of extra state events in every 5000th room.")
+@click.option(
+    "--reports", type=click.IntRange(min=0), default=1000,
+    show_default=True,
+    help="Number of event reports.")
+@click.option(
+    "--destinations", type=click.IntRange(min=0), default=1000,
+    show_default=True,
+    help="Number of federation destinations.")
+@click.option(
+    "--latency", "-l", type=click.FloatRange(min=0), default=0,
+    show_default=True,
+    help="Milliseconds to wait before answering each request.")
+@click.option(
+    "--verbose", "-v", is_flag=True, default=False,
+    help="Log every request.")
+def main(host, port, server_name, token, users, rooms, media_per_user,
+         heavy_state, reports, destinations, latency, verbose):
+    """ Serve a synthetic Synapse admin API for testing and benchmarks.
+    """
+    server = make_server(host, port, Dataset(
+        server_name, users, rooms, media_per_user, heavy_state, reports,
+        destinations
+    ), token, latency / 1000, verbose)
+    click.echo(f"Serving {users} users and {rooms} rooms of {server_name} "
+               f"on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,589 @@
+# -*- coding: utf-8 -*-
+# synadm
+# Copyright (C) 2020-2022 Johannes Tiefenbacher
+#
+# synadm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# synadm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Local SQLite stores
+
+Some synadm commands gather more data than is reasonable to fetch from the
+admin API over and over again. This module keeps such data in local SQLite
+databases, usually inside ~/.local/share/synadm.
+"""
+
+import os
+import re
+import json
+import sqlite3
+
+
+class Store:
+    """Basic SQLite database handling
+
+    This is subclassed by the actual stores, which define their tables in
+    SCHEMA.
+    """
+    SCHEMA = ""
+
+    def __init__(self, path, readonly=False):
+        """Open (and create if necessary) the database
+
+        Args:
+            path (string): path to the SQLite database file
+            readonly (bool): open an existing database read-only
+        """
+        self.path = path
+        if readonly:
+            self.db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        else:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.db = sqlite3.connect(path)
+            self.db.executescript(self.SCHEMA)
+        self.db.row_factory = sqlite3.Row
+
+    def query(self, sql, params=()):
+        """Run an SQL query
+
+        Args:
+            sql (string): the query
+            params (tuple or dict): parameters of the query
+
+        Returns:
+            list: a dict per row
+        """
+        return [dict(row) for row in self.db.execute(sql, params)]
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class MediaHashIndex(Store):
+    """Content hashes of local media
+
+    Media is identified by its media ID. Each run of a scan is identified by
+    a timestamp stored as "seen" with all media listed during that run, so
+    media deleted on the server in the meantime is left out of reports.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS media (
+            media_id TEXT PRIMARY KEY,
+            user_id TEXT,
+            media_length INTEGER,
+            sha256 TEXT,
+            seen INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS media_sha256 ON media (sha256);
+        CREATE INDEX IF NOT EXISTS media_seen ON media (seen);
+    """
+
+    def is_hashed(self, media_id, media_length, seen):
+        """Check whether media has been hashed already and mark it as seen
+
+        Args:
+            media_id (string): the media ID
+            media_length (int): the media's size in bytes; if it changed
+                since hashing, the media needs to be hashed again.
+            seen (int): the current run's timestamp
+
+        Returns:
+            bool: True if a hash of this media is known.
+        """
+        cursor = self.db.execute(
+            "UPDATE media SET seen = ? WHERE media_id = ? "
+            "AND media_length = ?", (seen, media_id, media_length))
+        return cursor.rowcount > 0
+
+    def add(self, media_id, user_id, media_length, sha256, seen):
+        self.db.execute(
+            "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?)",
+            (media_id, user_id, media_length, sha256, seen))
+
+    def duplicates(self, seen, limit, ids_limit=None):
+        """Get groups of identical media, biggest waste of storage first
+
+        Args:
+            seen (int): only consider media seen in this run
+            limit (int): maximum number of groups returned
+            ids_limit (int): maximum number of media IDs listed per group;
+                all if None. The number of copies is always the total.
+
+        Returns:
+            list: dicts containing the hash, the number of copies, the size
+                of a single copy, the reclaimable bytes and a list of media
+                IDs.
+        """
+        groups = self.query("""
+            SELECT sha256, COUNT(*) AS copies, MAX(media_length) AS length,
+                (COUNT(*) - 1) * MAX(media_length) AS reclaimable
+            FROM media WHERE seen = ?
+            GROUP BY sha256 HAVING COUNT(*) > 1
+            ORDER BY reclaimable DESC LIMIT ?
+        """, (seen, limit))
+        for group in groups:
+            group["media_ids"] = [row[0] for row in self.db.execute(
+                "SELECT media_id FROM media WHERE seen = ? AND sha256 = ? "
+                "ORDER BY media_id LIMIT ?",
+                (seen, group["sha256"], -1 if ids_limit is None else ids_limit)
+            )]
+        return groups
+
+    def summary(self, seen):
+        """Get totals of all media seen in a run
+
+        Args:
+            seen (int): the run's timestamp
+
+        Returns:
+            dict: the number of media and bytes, the number of groups of
+                identical media and the number of bytes that could be
+                reclaimed by deduplication.
+        """
+        row = self.db.execute("""
+            SELECT COUNT(*) AS media, COALESCE(SUM(media_length), 0) AS bytes
+            FROM media WHERE seen = ?
+        """, (seen,)).fetchone()
+        duplicates = self.db.execute("""
+            SELECT COUNT(*) AS duplicate_groups,
+                COALESCE(SUM(copies), 0) AS duplicate_media,
+                COALESCE(SUM((copies - 1) * length), 0) AS reclaimable_bytes
+            FROM (
+                SELECT COUNT(*) AS copies, MAX(media_length) AS length
+                FROM media WHERE seen = ?
+                GROUP BY sha256 HAVING COUNT(*) > 1
+            )
+        """, (seen,)).fetchone()
+        return dict(row, **dict(duplicates))
+
+
+class LastSeenCache(Store):
+    """When users were last seen and when this was checked
+
+    Synapse forgets client connections after a while (user_ips_max_age), so
+    the cache also remembers last seen times Synapse does not know anymore.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            last_seen_ts INTEGER,
+            checked_ts INTEGER
+        );
+    """
+
+    def get(self, user_id):
+        """Get the cached last seen time of a user
+
+        Returns:
+            tuple: (last_seen_ts, checked_ts) or None if the user is not
+                cached.
+        """
+        row = self.db.execute(
+            "SELECT last_seen_ts, checked_ts FROM users WHERE user_id = ?",
+            (user_id,)).fetchone()
+        return tuple(row) if row else None
+
+    def set(self, user_id, last_seen_ts, checked_ts):
+        """Cache when a user was last seen, keeping a later known time
+        """
+        self.db.execute("""
+            INSERT INTO users VALUES (?, ?, ?) ON CONFLICT (user_id) DO UPDATE
+            SET last_seen_ts = MAX(last_seen_ts, excluded.last_seen_ts),
+                checked_ts = excluded.checked_ts
+        """, (user_id, last_seen_ts, checked_ts))
+
+
+class Snapshot(Store):
+    """Users, rooms and media metadata mirrored from the admin API
+
+    Each table has a column for every field of the admin API's list (and room
+    details) responses that's commonly used in queries, plus the complete
+    response for the item as JSON in the data column.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS users (
+            name TEXT PRIMARY KEY,
+            displayname TEXT,
+            admin INTEGER,
+            deactivated INTEGER,
+            shadow_banned INTEGER,
+            is_guest INTEGER,
+            user_type TEXT,
+            avatar_url TEXT,
+            creation_ts INTEGER,
+            data TEXT
+        );
+        CREATE INDEX IF NOT EXISTS users_creation_ts ON users (creation_ts);
+        CREATE TABLE IF NOT EXISTS rooms (
+            room_id TEXT PRIMARY KEY,
+            name TEXT,
+            canonical_alias TEXT,
+            topic TEXT,
+            creator TEXT,
+            version TEXT,
+            joined_members INTEGER,
+            joined_local_members INTEGER,
+            state_events INTEGER,
+            encryption TEXT,
+            federatable INTEGER,
+            public INTEGER,
+            join_rules TEXT,
+            guest_access TEXT,
+            history_visibility TEXT,
+            room_type TEXT,
+            data TEXT
+        );
+        CREATE INDEX IF NOT EXISTS rooms_joined_members
+            ON rooms (joined_members);
+        CREATE INDEX IF NOT EXISTS rooms_state_events ON rooms (state_events);
+        CREATE TABLE IF NOT EXISTS media (
+            media_id TEXT PRIMARY KEY,
+            user_id TEXT,
+            media_type TEXT,
+            media_length INTEGER,
+            upload_name TEXT,
+            created_ts INTEGER,
+            last_access_ts INTEGER,
+            quarantined_by TEXT,
+            safe_from_quarantine INTEGER,
+            data TEXT
+        );
+        CREATE INDEX IF NOT EXISTS media_user_id ON media (user_id);
+        CREATE INDEX IF NOT EXISTS media_created_ts ON media (created_ts);
+    """
+
+    USER_COLUMNS = ("name", "displayname", "admin", "deactivated",
+                    "shadow_banned", "is_guest", "user_type", "avatar_url",
+                    "creation_ts")
+    ROOM_COLUMNS = ("room_id", "name", "canonical_alias", "topic", "creator",
+                    "version", "joined_members", "joined_local_members",
+                    "state_events", "encryption", "federatable", "public",
+                    "join_rules", "guest_access", "history_visibility",
+                    "room_type")
+    MEDIA_COLUMNS = ("media_id", "user_id", "media_type", "media_length",
+                     "upload_name", "created_ts", "last_access_ts",
+                     "quarantined_by", "safe_from_quarantine")
+
+    ROOM_SETTINGS = ("name", "canonical_alias", "topic", "version",
+                     "encryption", "federatable", "public", "join_rules",
+                     "guest_access", "history_visibility")
+
+    def _upsert(self, table, columns, item):
+        values = [item.get(column) for column in columns]
+        values.append(json.dumps(item))
+        self.db.execute(
+            "INSERT OR REPLACE INTO {} ({}, data) VALUES ({})".format(
+                table, ", ".join(columns), ", ".join("?" * (len(columns) + 1))
+            ), values)
+
+    def clear(self):
+        """Remove all users, rooms and media, e.g before a full sync
+        """
+        for table in ("users", "rooms", "media"):
+            self.db.execute(f"DELETE FROM {table}")
+
+    def add_user(self, user):
+        """Add or replace a user
+
+        Args:
+            user (dict): the user as returned by the user list API
+        """
+        self._upsert("users", self.USER_COLUMNS, user)
+
+    def add_room(self, room):
+        """Add or replace a room
+
+        Args:
+            room (dict): the room as returned by the room list or room
+                details API
+        """
+        self._upsert("rooms", self.ROOM_COLUMNS, room)
+
+    def add_media(self, user_id, media):
+        """Add or replace a piece of media
+
+        Args:
+            user_id (string): the user who uploaded the media
+            media (dict): the media as returned by the user media API
+        """
+        self._upsert("media", self.MEDIA_COLUMNS, dict(media, user_id=user_id))
+
+    def get_meta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?",
+                              (key,)).fetchone()
+        return json.loads(row["value"]) if row else default
+
+    def set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                        (key, json.dumps(value)))
+
+    def is_empty(self):
+        return self.get_meta("synced_at") is None
+
+    def newest_user_ts(self):
+        """Get the creation timestamp of the newest user in the snapshot
+
+        Returns:
+            int or None: creation_ts of the newest user or None if no
+                creation timestamps are known.
+        """
+        return self.db.execute(
+            "SELECT MAX(creation_ts) FROM users").fetchone()[0]
+
+    def room_counters(self):
+        """Get the counters used to detect changed rooms
+
+        Returns:
+            dict: room IDs mapped to a tuple of state_events and
+                joined_members
+        """
+        return {
+            row["room_id"]: (row["state_events"], row["joined_members"])
+            for row in self.db.execute(
+                "SELECT room_id, state_events, joined_members FROM rooms")
+        }
+
+    def remove_rooms(self, room_ids):
+        self.db.executemany("DELETE FROM rooms WHERE room_id = ?",
+                            ((room_id,) for room_id in room_ids))
+
+    def media_counts(self):
+        """Get the number of media of each user in the snapshot
+
+        Returns:
+            dict: user IDs mapped to their number of media
+        """
+        return dict(self.db.execute(
+            "SELECT user_id, COUNT(*) FROM media GROUP BY user_id"))
+
+    def replace_user_media(self, user_id, media_list):
+        """Replace all media of a user
+
+        Args:
+            user_id (string): the user who uploaded the media
+            media_list (list): the media as returned by the user media API
+        """
+        self.db.execute("DELETE FROM media WHERE user_id = ?", (user_id,))
+        for media in media_list:
+            self.add_media(user_id, media)
+
+    def diff(self, old_path):
+        """Compare this snapshot to an older one
+
+        Both snapshots are joined by user ID and room ID inside SQLite, so
+        this is fast even for large snapshots.
+
+        Args:
+            old_path (string): path to the older snapshot database
+
+        Returns:
+            dict: lists of users that were added, removed, deactivated,
+                reactivated, granted or revoked admin permission and lists of
+                rooms that were added, removed, changed membership or changed
+                settings.
+        """
+        self.db.execute("ATTACH DATABASE ? AS old",
+                        (f"file:{old_path}?mode=ro",))
+
+        def users(where, join="JOIN"):
+            return self.query(f"""
+                SELECT n.name, n.displayname FROM users n
+                {join} old.users o ON o.name = n.name WHERE {where}
+                ORDER BY n.name
+            """)
+
+        def rooms(columns, where, join="JOIN"):
+            return self.query(f"""
+                SELECT n.room_id, n.name, {columns} FROM rooms n
+                {join} old.rooms o ON o.room_id = n.room_id WHERE {where}
+                ORDER BY n.room_id
+            """)
+
+        settings_changed = []
+        for room in rooms(
+            ", ".join(f"o.{col} AS old_{col}, n.{col} AS new_{col}"
+                      for col in self.ROOM_SETTINGS),
+            " OR ".join(f"n.{col} IS NOT o.{col}"
+                        for col in self.ROOM_SETTINGS)
+        ):
+            settings_changed.append({
+                "room_id": room["room_id"],
+                "name": room["name"],
+                "changes": ", ".join(
+                    "{}: {} -> {}".format(col, room[f"old_{col}"],
+                                          room[f"new_{col}"])
+                    for col in self.ROOM_SETTINGS
+                    if room[f"old_{col}"] != room[f"new_{col}"]
+                )
+            })
+
+        diff = {
+            "users_added": users("o.name IS NULL", "LEFT JOIN"),
+            "users_removed": self.query("""
+                SELECT o.name, o.displayname FROM old.users o
+                LEFT JOIN users n ON n.name = o.name WHERE n.name IS NULL
+                ORDER BY o.name
+            """),
+            "users_deactivated": users(
+                "COALESCE(n.deactivated, 0) AND NOT COALESCE(o.deactivated, 0)"
+            ),
+            "users_reactivated": users(
+                "NOT COALESCE(n.deactivated, 0) AND COALESCE(o.deactivated, 0)"
+            ),
+            "users_admin_granted": users(
+                "COALESCE(n.admin, 0) AND NOT COALESCE(o.admin, 0)"),
+            "users_admin_revoked": users(
+                "NOT COALESCE(n.admin, 0) AND COALESCE(o.admin, 0)"),
+            "rooms_added": rooms("n.joined_members", "o.room_id IS NULL",
+                                 "LEFT JOIN"),
+            "rooms_removed": self.query("""
+                SELECT o.room_id, o.name, o.joined_members FROM old.rooms o
+                LEFT JOIN rooms n ON n.room_id = o.room_id
+                WHERE n.room_id IS NULL ORDER BY o.room_id
+            """),
+            "rooms_membership_changed": rooms(
+                "o.joined_members AS old_joined_members, "
+                "n.joined_members AS new_joined_members, "
+                "n.joined_members - o.joined_members AS delta",
+                "n.joined_members IS NOT o.joined_members"
+            ),
+            "rooms_settings_changed": settings_changed,
+        }
+        self.db.execute("DETACH DATABASE old")
+        return diff
+
+
+class SearchIndex(Store):
+    """Trigram index over users and rooms
+
+    Every entry is a user (kind "user", keyed by MXID) or a room (kind
+    "room", keyed by room ID) with a name and an alias: the display name and
+    the room name respectively, and the canonical alias of rooms. Searching
+    splits the term into trigrams and ranks entries by the share of these
+    they have in common, which is case-insensitive and tolerates typos.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            kind TEXT,
+            name TEXT,
+            alias TEXT,
+            trigrams INTEGER,
+            seen INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS entries_kind ON entries (kind, seen);
+        CREATE TABLE IF NOT EXISTS trigrams (
+            trigram TEXT,
+            key TEXT
+        );
+        CREATE INDEX IF NOT EXISTS trigrams_trigram ON trigrams (trigram);
+        CREATE INDEX IF NOT EXISTS trigrams_key ON trigrams (key);
+    """
+
+    @staticmethod
+    def trigrams(*texts):
+        """Split texts into lowercase trigrams of words
+
+        Words are padded like PostgreSQL's pg_trgm does, so the start and
+        end of words weigh more, e.g "Bob" yields "  b", " bo", "bob" and
+        "ob ".
+        """
+        grams = set()
+        for text in texts:
+            for word in re.findall(r"\w+", (text or "").lower()):
+                word = f"  {word} "
+                grams.update(word[i:i + 3] for i in range(len(word) - 2))
+        return grams
+
+    def is_empty(self, kind):
+        return self.db.execute("SELECT 1 FROM entries WHERE kind = ? LIMIT 1",
+                               (kind,)).fetchone() is None
+
+    def update(self, kind, key, name, alias, seen):
+        """Add an entry or update it if its name or alias changed
+
+        Args:
+            kind (string): "user" or "room"
+            key (string): the MXID or room ID
+            name (string): display name or room name
+            alias (string): canonical alias of a room
+            seen (int): the current refresh's timestamp
+
+        Returns:
+            bool: True if the entry needed to be (re-)indexed.
+        """
+        cursor = self.db.execute(
+            "UPDATE entries SET seen = ? WHERE key = ? AND name IS ? "
+            "AND alias IS ?", (seen, key, name, alias))
+        if cursor.rowcount > 0:
+            return False
+        if kind == "user":
+            grams = self.trigrams(key, name)
+        else:
+            grams = self.trigrams(name, alias)
+        self.db.execute("DELETE FROM trigrams WHERE key = ?", (key,))
+        self.db.executemany("INSERT INTO trigrams VALUES (?, ?)",
+                            ((gram, key) for gram in grams))
+        self.db.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+            (key, kind, name, alias, len(grams), seen))
+        return True
+
+    def remove_unseen(self, kind, seen):
+        """Remove entries that were not seen during the current refresh
+
+        Returns:
+            int: the number of removed entries
+        """
+        self.db.execute(
+            "DELETE FROM trigrams WHERE key IN (SELECT key FROM entries "
+            "WHERE kind = ? AND seen != ?)", (kind, seen))
+        return self.db.execute(
+            "DELETE FROM entries WHERE kind = ? AND seen != ?",
+            (kind, seen)).rowcount
+
+    def search(self, kind, term, limit, offset=0, min_score=0.0):
+        """Find entries similar to a search term
+
+        Args:
+            kind (string): "user" or "room"
+            term (string): the search term
+            limit (int): maximum number of results
+            offset (int): skip this many results
+            min_score (float): minimum share of the term's trigrams an entry
+                needs to have, between 0 and 1
+
+        Returns:
+            list: dicts of key, name, alias and score, best matches first.
+                Ties are ranked by shortness of the entry.
+        """
+        grams = self.trigrams(term)
+        if not grams:
+            return []
+        return self.query("""
+            SELECT e.key, e.name, e.alias,
+                ROUND(COUNT(*) * 1.0 / ?, 2) AS score
+            FROM trigrams t JOIN entries e ON e.key = t.key
+            WHERE t.trigram IN ({}) AND e.kind = ?
+            GROUP BY e.key HAVING score >= ?
+            ORDER BY score DESC, e.trigrams, e.key LIMIT ? OFFSET ?
+        """.format(", ".join("?" * len(grams))),
+            (len(grams), *grams, kind, min_score, limit, offset))
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# synadm
+# Copyright (C) 2020-2022 Johannes Tiefenbacher
+#
+# synadm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# synadm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Unit tests of API client helpers that don't need a server
+
+Run with: python3 -m unittest discover tests
+"""
+
+import logging
+import unittest
+
+from synadm import api
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+class SynapseAdminTest(unittest.TestCase):
+    def setUp(self):
+        log = logging.getLogger("synadm-test")
+        self.api = api.SynapseAdmin(log, "admin", "token",
+                                    "http://127.0.0.1:1", "/_synapse/admin",
+                                    10, False)
+
+    def test_time_slices(self):
+        slices = list(self.api._time_slices(0, 5 * DAY_MS, 2))
+        self.assertEqual(slices, [(0, 2 * DAY_MS), (2 * DAY_MS, 4 * DAY_MS),
+                                  (4 * DAY_MS, 5 * DAY_MS)])
+
+    def test_time_slices_empty(self):
+        self.assertEqual(list(self.api._time_slices(DAY_MS, DAY_MS, 1)), [])
+
+    def test_time_slices_not_positive(self):
+        for slice_days in (0, -1):
+            with self.assertRaises(ValueError):
+                list(self.api._time_slices(0, DAY_MS, slice_days))
+
+    def test_media_delete_plan_never_accessed(self):
+        user = {"name": "@alice:example.org", "avatar_url": None}
+        media = {"media_id": "unused", "created_ts": 1000,
+                 "last_access_ts": None, "media_length": 500,
+                 "quarantined_by": None, "safe_from_quarantine": False}
+        recent = dict(media, media_id="recent", created_ts=10 ** 13 + 1)
+        self.api.local_users_media = lambda workers: iter([
+            (user, [media, recent])
+        ])
+        plans = list(self.api.media_delete_plan(None, None, 10 ** 13, None,
+                                                False, 1))
+        self.assertEqual(plans, [{"user_id": "@alice:example.org",
+                                  "media": 1, "bytes": 500}])
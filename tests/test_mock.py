@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# synadm
+# Copyright (C) 2020-2022 Johannes Tiefenbacher
+#
+# synadm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# synadm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Smoke tests running synadm's API client against the mock server
+
+Run with: python3 -m unittest discover tests
+"""
+
+import logging
+import threading
+import unittest
+
+from synadm import api, mock
+
+
+class MockServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dataset = mock.Dataset("example.org", 1234, 321, 5, 100, 250, 50)
+        cls.server = mock.make_server("127.0.0.1", 0, cls.dataset, "token")
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        log = logging.getLogger("synadm-test")
+        cls.api = api.SynapseAdmin(log, "admin", "token", base_url,
+                                   "/_synapse/admin", 10, False)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_user_list_pages(self):
+        first = self.api.user_list(0, 100, True, True, "", "")
+        self.assertEqual(len(first["users"]), 100)
+        second = self.api.user_list(first["next_token"], 100, True, True,
+                                    "", "")
+        self.assertEqual(second["users"][0]["name"],
+                         self.dataset.user_id(100))
+
+    def test_user_list_all(self):
+        users = [user["name"] for user in
+                 self.api.user_list_all(page_size=100)]
+        self.assertEqual(len(users), self.dataset.users)
+        self.assertEqual(len(set(users)), self.dataset.users)
+
+    def test_user_list_all_filtered(self):
+        users = list(self.api.user_list_all(guests=False, deactivated=False,
+                                            page_size=100))
+        self.assertNotIn(None, users)
+        self.assertFalse(any(user["deactivated"] or user["is_guest"]
+                             for user in users))
+        total = self.api.user_list(0, 1, False, False, "", "")["total"]
+        self.assertEqual(len(users), total)
+
+    def test_room_list_all(self):
+        rooms = [room["room_id"] for room in self.api.room_list_all(
+            order_by="joined_members", page_size=50
+        )]
+        self.assertEqual(len(rooms), self.dataset.rooms)
+        self.assertEqual(len(set(rooms)), self.dataset.rooms)
+
+    def test_event_report_list_all(self):
+        reports = list(self.api.event_report_list_all(page_size=40))
+        self.assertEqual(len(reports), self.dataset.reports)
+        self.assertEqual(reports[0]["id"], self.dataset.reports - 1)
+
+    def test_invalid_token(self):
+        client = api.SynapseAdmin(self.api.log, "admin", "wrong",
+                                  self.api.base_url, "/_synapse/admin", 10,
+                                  False)
+        self.assertEqual(client.version()["errcode"], "M_UNKNOWN_TOKEN")
+
+
+if __name__ == "__main__":
+    unittest.main()
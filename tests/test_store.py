@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# synadm
+# Copyright (C) 2020-2022 Johannes Tiefenbacher
+#
+# synadm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# synadm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests of the local SQLite stores
+
+Run with: python3 -m unittest discover tests
+"""
+
+import os
+import tempfile
+import unittest
+
+from synadm import store
+
+
+class MediaHashIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.index = store.MediaHashIndex(
+            os.path.join(self.tmp.name, "media_hashes.db"))
+        for number in range(10):
+            self.index.add(f"media{number}", "@alice:example.org", 100,
+                           "a" if number < 8 else "b", 1)
+        self.index.add("unique", "@alice:example.org", 100, "c", 1)
+        self.index.add("old", "@alice:example.org", 100, "a", 0)
+
+    def tearDown(self):
+        self.index.close()
+        self.tmp.cleanup()
+
+    def test_duplicates(self):
+        groups = self.index.duplicates(1, 10)
+        self.assertEqual([group["sha256"] for group in groups], ["a", "b"])
+        self.assertEqual(groups[0]["copies"], 8)
+        self.assertEqual(groups[0]["reclaimable"], 700)
+        self.assertEqual(len(groups[0]["media_ids"]), 8)
+
+    def test_duplicates_ids_limit(self):
+        groups = self.index.duplicates(1, 10, 3)
+        self.assertEqual(groups[0]["media_ids"],
+                         ["media0", "media1", "media2"])
+        self.assertEqual(groups[0]["copies"], 8)
+        self.assertEqual(groups[1]["media_ids"], ["media8", "media9"])